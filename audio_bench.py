@@ -0,0 +1,554 @@
+import sound
+import vban
+import discord
+import sounddevice as sd
+import numpy as np
+import threading
+import argparse
+import asyncio
+import logging
+import socket
+import struct
+import random
+import time
+
+print_formatter = logging.Formatter(
+	fmt="[%(name)s - %(levelname)s] %(message)s"
+)
+
+print_handler = logging.StreamHandler()
+print_handler.setLevel(logging.INFO)
+print_handler.setFormatter(print_formatter)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.DEBUG)
+root_logger.addHandler(print_handler)
+
+# ------------
+# Benchmarks and stress checks for the audio path
+# ------------
+
+# bytes name_bytes
+# VBAN stream name used by every benchmark that sends packets
+name_bytes = vban.packStreamName("bench")
+
+# params: int frames
+# return: boolean
+def stress_frame_ring(frames):
+	# hammers a FrameRing from a writer thread and a reader thread at full speed
+	# every frame is stamped with its index, so torn or lost frames show up as a mismatch
+	frame_len = sound.VBANStream.bytes_per_frame
+	# int packet_len
+	# VBAN packets don't line up with Discord frames, so write in odd-sized pieces
+	packet_len = 1024
+	ring = sound.FrameRing(8, frame_len)
+	# list[str] errors
+	errors = []
+
+	def writer():
+		# bytes pending
+		pending = b""
+		for i in range(frames):
+			pending += i.to_bytes(4, "little") * (frame_len // 4)
+			while len(pending) >= packet_len or (i == frames - 1 and pending):
+				# int written
+				written = ring.write(pending[0:packet_len])
+				if written == 0:
+					# ring is full; give the reader a turn
+					time.sleep(0)
+				pending = pending[written:]
+
+	def reader():
+		# bytearray frame
+		frame = bytearray(frame_len)
+		for i in range(frames):
+			# int got
+			got = 0
+			while got < frame_len:
+				# int count
+				count = ring.read_into(memoryview(frame)[got:])
+				if count == 0:
+					# ring is empty; give the writer a turn
+					time.sleep(0)
+				got += count
+			if frame != i.to_bytes(4, "little") * (frame_len // 4):
+				errors.append("Frame {} torn or out of order".format(i))
+				return
+
+	# float start
+	start = time.perf_counter()
+	threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	# float elapsed
+	elapsed = time.perf_counter() - start
+
+	if errors or len(ring) != 0:
+		for error in errors:
+			logging.error(error)
+		logging.error("FrameRing stress check failed ({} bytes left over)".format(len(ring)))
+		return False
+	logging.info("FrameRing stress check passed: {} frames in {:.2f} s".format(frames, elapsed))
+	return True
+
+# params: int frames
+def bench_formats(frames):
+	# times VBAN_Converter on one 20 ms frame of 48 kHz stereo in each supported data format
+	# float signal
+	signal = np.sin(np.arange(960 * 2) * 0.01) * 0.5
+	# dict[int, bytes] payloads
+	payloads = {
+		0: (np.rint(signal * 127) + 128).astype("u1").tobytes(),
+		1: np.rint(signal * 32767).astype("<i2").tobytes(),
+		2: np.rint(signal * 8388607).astype("<i4").view("u1").reshape(-1, 4)[:, 0:3].tobytes(),
+		3: np.rint(signal * 2147483647).astype("<i4").tobytes(),
+		4: signal.astype("<f4").tobytes(),
+		5: signal.astype("<f8").tobytes(),
+	}
+	# dict[int, str] names
+	names = {0: "8-bit", 1: "16-bit", 2: "24-bit", 3: "32-bit", 4: "float32", 5: "float64"}
+	for data_format, payload in payloads.items():
+		converter = vban.VBAN_Converter(48000, 2, data_format)
+		# float start
+		start = time.perf_counter()
+		for i in range(frames):
+			converter.convert(payload)
+		# float elapsed
+		elapsed = time.perf_counter() - start
+		logging.info("{:>8} -> 16-bit: {:7.1f} us per 20 ms frame".format(names[data_format], elapsed / frames * 1e6))
+
+class TimingSink(object):
+	"""Stands in for VBANStream and records when each packet makes it through VBAN_Recv"""
+	def __init__(self):
+		self.times = []
+
+	def write(self, pcm):
+		self.times.append(time.perf_counter())
+
+	def close(self):
+		pass
+
+# params: int count, int port
+# return: List[float]
+# sends count VBAN packets of 256 stereo samples to localhost, paced like a real sender
+def send_loopback(count, port):
+	# socket.socket sock
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	# bytes prefix
+	prefix = vban.VBAN_Header.pack(b"VBAN", 3, 255, 1, 1, name_bytes, 0)[0:24]
+	# bytes payload
+	payload = bytes(1024)
+	# List[float] times
+	times = []
+	# float start
+	start = time.perf_counter()
+	for i in range(count):
+		# sleep until this packet's slot, 256 samples at 48 kHz apart
+		delay = start + i * 256 / 48000 - time.perf_counter()
+		if delay > 0:
+			time.sleep(delay)
+		times.append(time.perf_counter())
+		sock.sendto(prefix + struct.pack("<L", i) + payload, ("127.0.0.1", port))
+	sock.close()
+	return times
+
+# params: int packets, str mode
+# return: List[float]
+async def measure_receive_latency(packets, mode):
+	# int port
+	port = 16980
+	sink = TimingSink()
+	receiver = vban.VBAN_Recv("127.0.0.1", "bench", port, 0, ipv6=False, stream=sink)
+
+	async def poll():
+		while True:
+			try:
+				receiver.runforever()
+			except IndexError:
+				await asyncio.sleep(0.02)
+
+	if mode == "poll":
+		task = asyncio.create_task(poll())
+	elif mode == "thread":
+		receiver.startThread()
+	else:
+		await receiver.listen()
+	# List[float] sent
+	sent = await asyncio.get_running_loop().run_in_executor(None, send_loopback, packets, port)
+	await asyncio.sleep(0.1)
+	if mode == "poll":
+		task.cancel()
+	receiver.quit()
+	return [received - sent[i] for i, received in enumerate(sink.times)]
+
+# params: int frames
+def bench_receive(frames):
+	# compares how long packets wait between the socket and VBANStream.write() in each receive mode
+	# int packets
+	# 256-sample packets, so a bit under four per 20 ms frame
+	packets = min(frames, 2000) * 15 // 4
+	for mode in ("poll", "event", "thread"):
+		latencies = sorted(asyncio.run(measure_receive_latency(packets, mode)))
+		if len(latencies) == 0:
+			logging.error("{:>6}: nothing received".format(mode))
+			continue
+		logging.info("{:>6}: {} packets, median {:.2f} ms, 99th percentile {:.2f} ms, worst {:.2f} ms".format(
+			mode, len(latencies), latencies[len(latencies) // 2] * 1000, latencies[len(latencies) * 99 // 100] * 1000, latencies[-1] * 1000))
+
+class RingSink(object):
+	"""Stands in for VBANStream, copying each packet into a FrameRing and throwing it away again"""
+	def __init__(self):
+		self.ring = sound.FrameRing(8, sound.VBANStream.bytes_per_frame)
+		self.scratch = bytearray(vban.VBAN_PacketPool.slot_size)
+		self.packets = 0
+
+	def write(self, pcm):
+		self.ring.write(pcm)
+		self.ring.read_into(self.scratch)
+		self.packets += 1
+
+	def close(self):
+		pass
+
+# params: int frames
+def bench_receive_path(frames):
+	# times the per-packet cost of getting a VBAN packet from the socket into the stream buffer
+	# "recvfrom" allocates a bytes per packet and slices the payload out of it, as VBAN_Recv used to
+	# "recv_into" reads batches into the preallocated pool and passes memoryviews all the way through
+	# int burst
+	# small enough that a burst fits in the socket's receive buffer
+	burst = 200
+	# int rounds
+	rounds = max(1, frames * 15 // 4 // burst)
+	# int port
+	port = 16981
+	# bytes prefix
+	prefix = vban.VBAN_Header.pack(b"VBAN", 3, 255, 1, 1, name_bytes, 0)[0:24]
+	# bytes payload
+	payload = bytes(1024)
+	sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	for mode in ("recvfrom", "recv_into"):
+		sink = RingSink()
+		receiver = vban.VBAN_Recv("127.0.0.1", "bench", port, 0, ipv6=False, stream=sink)
+		receiver.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+		# int counter
+		counter = 0
+		# float elapsed
+		elapsed = 0.0
+		for r in range(rounds):
+			for i in range(burst):
+				sender.sendto(prefix + struct.pack("<L", counter) + payload, ("127.0.0.1", port))
+				counter += 1
+			# float start
+			start = time.perf_counter()
+			if mode == "recvfrom":
+				for i in range(burst):
+					data, addr = receiver.sock.recvfrom(2048)
+					receiver.handlePacket(data, addr, time.monotonic())
+			else:
+				# int received
+				received = 0
+				while received < burst:
+					received += receiver.runbatch(burst - received)
+			elapsed += time.perf_counter() - start
+		receiver.quit()
+		logging.info("{:>9}: {} packets, {:.2f} us per packet".format(mode, sink.packets, elapsed / max(sink.packets, 1) * 1e6))
+	sender.close()
+
+class StampSink(object):
+	"""Stands in for VBANStream and checks that each packet is the one stamped with the next index"""
+	def __init__(self, packet_len):
+		self.packet_len = packet_len
+		# int expected
+		self.expected = 0
+		# int concealed, wrong
+		# packets that were filled in rather than played, and ones that came out as the wrong audio
+		self.concealed = 0
+		self.wrong = 0
+
+	def write(self, pcm):
+		if bytes(pcm) != stamp_packet(self.expected, self.packet_len):
+			if len(pcm) == self.packet_len and bytes(pcm[0:4]) * (self.packet_len // 4) == bytes(pcm):
+				self.wrong += 1
+			else:
+				self.concealed += 1
+		self.expected += 1
+
+	def close(self):
+		pass
+
+# params: int index, int packet_len
+# return: bytes
+def stamp_packet(index, packet_len):
+	return index.to_bytes(4, "little") * (packet_len // 4)
+
+# params: int frames
+# return: boolean
+def stress_redundancy(frames):
+	# runs real VBAN_Send output through a lossy link into VBAN_Recv and checks what redundancy gets back
+	# the sender's capture is stopped and fed by hand, so every packet is stamped with its index and rebuilt audio can
+	# be checked byte for byte
+	sd.default.channels = 2
+	sd.default.dtype = "int16"
+	# float loss
+	loss = 0.02
+	# int packets
+	packets = min(frames * 15 // 4, 20000)
+	# int port
+	port = 16982
+	# bool success
+	success = True
+	for mode in (None, "duplicate", "parity"):
+		listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		listener.bind(("127.0.0.1", port))
+		listener.setblocking(False)
+		sender = vban.VBAN_Send("127.0.0.1", port, "bench", 48000, None, ipv6=False, redundancy=mode)
+		sender.stream.stop()
+		while len(sender.queue) > 0:
+			# anything the device captured before we stopped it
+			sender.queue.pop()
+		# int packet_len
+		packet_len = sender.queue.slotSize
+		sink = StampSink(packet_len)
+		receiver = vban.VBAN_Recv(None, "bench", port + 1, 0, ipv6=False, stream=sink)
+		# vban.VBAN_RecvRoute route
+		route = receiver.routes[(None, name_bytes)]
+		# the same losses for every mode
+		chance = random.Random(0)
+		# int dropped
+		dropped = 0
+		for i in range(packets):
+			sender.queue.put(stamp_packet(i, packet_len))
+			sender.runonce()
+			while True:
+				try:
+					data, addr = listener.recvfrom(2048)
+				except BlockingIOError:
+					break
+				# the first few always get through, so the receiver knows where the stream starts
+				if i > 8 and chance.random() < loss:
+					dropped += 1
+					continue
+				receiver.handlePacket(data, addr, time.perf_counter())
+		# int missing
+		missing = route.jitterBuffer.recovered + route.jitterBuffer.lost
+		logging.info("{:>9}: {} packets, {} datagrams dropped, {} packets concealed, {} wrong; {}".format(
+			mode or "none", packets, dropped, sink.concealed, sink.wrong, route.redundancyStats() or "no redundancy"))
+		if sink.wrong > 0:
+			logging.error("Redundancy rebuilt {} packets as the wrong audio".format(sink.wrong))
+			success = False
+		if mode == "duplicate" and sink.concealed > missing // 10:
+			# a packet and its copy are both lost only a few times in a thousand; nearly everything should come back
+			logging.error("Duplicates only rebuilt {} of {} missing packets".format(missing - sink.concealed, missing))
+			success = False
+		sender.quit()
+		receiver.quit()
+		listener.close()
+	return success
+
+# params: bytes data
+# return: tuple
+# how VBAN_Recv used to parse headers, kept here for comparison
+def legacy_parse_header(data):
+	magic = data[0:4].decode('utf-8')
+	sampRateIndex = data[4] & 0x1F
+	subprotocol = (data[4] & 0xE0) >> 5
+	sampNum = data[5] + 1
+	chanNum = data[6] + 1
+	dataFormat = data[7]
+	streamName = b''.join(struct.unpack("cccccccccccccccc", data[8:24])).decode('utf-8').split("\x00")[0]
+	frameCounter = struct.unpack("<L", data[24:28])[0]
+	return (magic == "VBAN" and streamName == "bench", sampRateIndex, subprotocol, sampNum, chanNum, dataFormat, frameCounter)
+
+# params: bytes data
+# return: tuple
+def codec_parse_header(data):
+	magic, sampRateByte, sampNum, chanNum, dataFormat, streamName, frameCounter = vban.VBAN_Header.unpack_from(data)
+	return (magic == b"VBAN" and streamName == name_bytes, sampRateByte & 0x1F, sampRateByte >> 5, sampNum + 1, chanNum + 1, dataFormat, frameCounter)
+
+# params: int frames
+def bench_header(frames):
+	# parses the same VBAN header over and over with the old and new code
+	# bytes packet
+	packet = vban.VBAN_Header.pack(b"VBAN", 3, 255, 1, 1, name_bytes, 12345) + bytes(1024)
+	# int count
+	count = frames * 15 // 4
+	if legacy_parse_header(packet) != codec_parse_header(packet):
+		logging.error("Header parsers disagree!")
+		return False
+	for name, parse in (("legacy", legacy_parse_header), ("struct", codec_parse_header)):
+		# float start
+		start = time.perf_counter()
+		for i in range(count):
+			parse(packet)
+		# float elapsed
+		elapsed = time.perf_counter() - start
+		logging.info("{:>6}: {:.2f} us per header, {:.0f} headers per second".format(name, elapsed / count * 1e6, count / elapsed))
+
+class ToneSource(discord.AudioSource):
+	"""Endless 20 ms frames of a quiet tone"""
+	def __init__(self):
+		self.frame = (np.sin(np.arange(960 * 2) * 0.01) * 3000).astype(np.int16).tobytes()
+
+	def read(self):
+		return self.frame
+
+# params: int frames
+# return: boolean
+# None when it's skipped
+def bench_broadcast(frames):
+	# compares encoding the same source once per voice client with encoding it once for all of them
+	try:
+		encoder = discord.opus.Encoder()
+	except discord.opus.OpusNotLoaded:
+		# nothing wrong with our code; this machine just can't encode, so don't fail the whole run over it
+		logging.warning("Opus isn't available; skipping the broadcast benchmark")
+		return None
+	# int count
+	count = max(1, frames // 10)
+	for clients in (1, 4, 16):
+		source = ToneSource()
+		# List[discord.opus.Encoder] encoders
+		# what discord.py does without broadcasting: one encoder per voice client
+		encoders = [discord.opus.Encoder() for i in range(clients)]
+		# float start
+		start = time.perf_counter()
+		for i in range(count):
+			for client_encoder in encoders:
+				client_encoder.encode(source.read(), client_encoder.SAMPLES_PER_FRAME)
+		# float separate
+		separate = time.perf_counter() - start
+
+		broadcast = sound.OpusBroadcast(source, encoder)
+		listeners = [broadcast.listen() for i in range(clients)]
+		start = time.perf_counter()
+		for i in range(count):
+			for listener in listeners:
+				listener.read()
+		# float shared
+		shared = time.perf_counter() - start
+		logging.info("{:>2} voice clients: {:7.1f} us per frame encoding separately, {:7.1f} us per frame broadcasting ({} encodes)".format(
+			clients, separate / count * 1e6, shared / count * 1e6, broadcast.encoded))
+
+# params: int frames
+# return: boolean
+def bench_gain(frames):
+	# times discord.PCMVolumeTransformer against sound.GainStage on the same frames
+	# List[tuple(str, float, float)] cases
+	# name, starting volume, volume after the first frame
+	cases = [("unity", 1.0, 1.0), ("half", 0.5, 0.5), ("ramping", 0.5, 1.5)]
+	for name, start_volume, volume in cases:
+		# List[float] elapsed
+		elapsed = []
+		for make in (discord.PCMVolumeTransformer, sound.GainStage):
+			gain = make(ToneSource(), volume=start_volume)
+			gain.volume = volume
+			# float start
+			start = time.perf_counter()
+			for i in range(frames):
+				if name == "ramping":
+					# keep it ramping by nudging the volume every frame
+					gain.volume = volume if i % 2 == 0 else start_volume
+				gain.read()
+			elapsed.append(time.perf_counter() - start)
+		logging.info("{:>7}: PCMVolumeTransformer {:5.1f} us per frame, GainStage {:5.1f} us per frame".format(
+			name, elapsed[0] / frames * 1e6, elapsed[1] / frames * 1e6))
+
+	# a quiet tone turned up twenty times has to saturate rather than wrap around
+	loud = sound.GainStage(ToneSource(), volume=20.0)
+	# np.ndarray samples
+	samples = np.frombuffer(loud.read(), dtype=np.int16)
+	if samples.max() != 32767 or samples.min() != -32768:
+		logging.error("GainStage doesn't saturate!")
+		return False
+
+class BurstSource(discord.AudioSource):
+	"""Bursts of loud tone with quiet noise in between, so every DSP stage has something to do"""
+	def __init__(self):
+		self.count = 0
+		self.rng = np.random.default_rng(1)
+
+	def read(self):
+		self.count += 1
+		# float level
+		# half a second on, half a second off, and far too loud while it's on
+		level = 40000.0 if (self.count // 25) % 2 == 0 else 30.0
+		samples = np.sin(np.arange(960 * 2) * 0.05 + self.count) * level + self.rng.normal(0.0, 30.0, 960 * 2)
+		return np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+
+# params: int frames
+# return: boolean
+def bench_dsp(frames):
+	# times each stage of a gate -> compressor -> limiter chain, and checks the limiter holds its ceiling
+	# float ceiling_db
+	ceiling_db = -1.0
+	stages = [
+		sound.NoiseGate(-50.0, 200.0, 100.0),
+		sound.Compressor(-18.0, 4.0, 10.0, 200.0, 0.0),
+		sound.Limiter(ceiling_db, 100.0),
+	]
+	chain = sound.DSPChain(BurstSource(), stages)
+	# int ceiling
+	ceiling = int(np.ceil(32768.0 * 10.0 ** (ceiling_db / 20.0)))
+	# int loudest
+	loudest = 0
+	# float start
+	start = time.perf_counter()
+	for i in range(frames):
+		samples = np.frombuffer(chain.read(), dtype=np.int16)
+		loudest = max(loudest, int(np.max(np.abs(samples.astype(np.int32)))))
+	# float elapsed
+	elapsed = time.perf_counter() - start
+	logging.info("{} frames, {:.1f} us per frame for the whole chain".format(frames, elapsed / frames * 1e6))
+	logging.info(chain.report())
+	if loudest > ceiling:
+		logging.error("Limiter let a sample of {} through a ceiling of {}".format(loudest, ceiling))
+		return False
+
+# dict[str, function] benchmarks
+benchmarks = {
+	"ring": lambda args: stress_frame_ring(args.frames),
+	"formats": lambda args: bench_formats(args.frames),
+	"receive": lambda args: bench_receive(args.frames),
+	"recvpath": lambda args: bench_receive_path(args.frames),
+	"redundancy": lambda args: stress_redundancy(args.frames),
+	"header": lambda args: bench_header(args.frames),
+	"broadcast": lambda args: bench_broadcast(args.frames),
+	"gain": lambda args: bench_gain(args.frames),
+	"dsp": lambda args: bench_dsp(args.frames),
+}
+
+parser = argparse.ArgumentParser(description="Discord Audio Pipe benchmarks")
+
+parser.add_argument(
+	"names",
+	nargs="*",
+	default=list(benchmarks.keys()),
+	help="Which benchmarks to run (default: all of them)",
+)
+
+parser.add_argument(
+	"-n",
+	"--frames",
+	dest="frames",
+	type=int,
+	default=20000,
+	help="How many 20 ms frames to push through each benchmark",
+)
+
+args = parser.parse_args()
+
+# bool success
+success = True
+for name in args.names:
+	if name not in benchmarks:
+		logging.error("Unknown benchmark \"{}\"".format(name))
+		success = False
+		continue
+	success = benchmarks[name](args) is not False and success
+
+if not success:
+	quit(1)
@@ -9,20 +9,48 @@ import socket
 import aiohttp
 from ipv6_injection import IPv6VoiceClient
 
+class GuildSession(object):
+	"""Everything the bot keeps for its voice connection in one guild"""
+	# params: int guild_id
+	def __init__(self, guild_id):
+		# int guild_id
+		self.guild_id = guild_id
+		# discord.VoiceClient voice
+		self.voice = None
+		# discord.AudioSource stream
+		# what we're playing, before volume is applied; shared by every session when broadcasting
+		self.stream = None
+		# float volume
+		self.volume = config.get_config_float("Audio", "volume")
+		# str stream_name
+		# which VBAN stream this guild hears
+		self.stream_name = config.get_config_string("VBAN", "stream_name")
+
 class Dap_Bot(commands.Bot):
 	def __init__(self, command_prefix, intents):
 		commands.Bot.__init__(self, command_prefix, intents=intents)
-		# discord.AudioSource stream
-		self.stream = None
+		# dict[int, GuildSession] sessions
+		# keyed by guild id
+		self.sessions = {}
 		# int device_id
 		self.device_id = -1
-		# discord.VoiceClient voice
-		self.voice = None
 		# boolean use_vban
 		self.use_vban = False
+		# boolean use_mixer
+		self.use_mixer = False
+		# boolean use_broadcast
+		self.use_broadcast = False
+		# sound.OpusBroadcast broadcast
+		# when broadcasting, the one encoded stream every voice client plays from
+		self.broadcast = None
+		# discord.AudioSource broadcast_stream
+		# what the broadcast is made from, before any processing
+		self.broadcast_stream = None
 
 	def apply_config(self):
 		self.use_vban = config.get_config_bool("Audio", "use_vban")
+		self.use_mixer = config.get_config_bool("Mixer", "enabled")
+		self.use_broadcast = config.get_config_bool("Audio", "broadcast")
 		ipv6 = config.get_config_bool("System", "ipv6")
 		if ipv6:
 			logging.info("Injecting IPv6 support")
@@ -33,32 +61,105 @@ class Dap_Bot(commands.Bot):
 			# already exists, and it's cool with pre-made TCPConnectors.
 			self.http.connector = aiohttp.TCPConnector(limit=0, family=socket.AF_INET6)
 
-	def start_stream(self):
-		if self.voice is None:
+	# params: int guild_id
+	# return: GuildSession
+	def get_session(self, guild_id):
+		# GuildSession session
+		session = self.sessions.get(guild_id)
+		if session is None:
+			session = GuildSession(guild_id)
+			self.sessions[guild_id] = session
+		return session
+
+	# params: GuildSession session
+	def start_stream(self, session):
+		if session.voice is None:
+			return
+
+		# the old stream's gate mustn't go on pausing and resuming this voice client
+		self.detach_gate(session.stream, session.voice)
+		# a player paused for silence doesn't count as playing, but its thread is still there waiting to be resumed;
+		# playing over it would leave that thread, and the old source, waiting forever
+		if session.voice.is_playing() or session.voice.is_paused():
+			session.voice.stop()
+
+		if self.use_broadcast and self.broadcast is not None:
+			# we're already capturing and encoding for another voice client; this one just listens in
+			session.stream = self.broadcast_stream
+			session.voice.play(self.broadcast.listen())
+			self.attach_gate(session.stream, session.voice)
 			return
-	
-		if self.use_vban:
-			self.stream = sound.VBANStream()
-			self.stream.start_vban()
+
+		session.stream = self.create_stream(session)
+
+		if self.use_broadcast:
+			self.broadcast_stream = session.stream
+			self.broadcast = sound.OpusBroadcast(self.make_source(session.stream, session.volume))
+			session.voice.play(self.broadcast.listen())
+		else:
+			session.voice.play(session.stream)
+			session.voice.source = self.make_source(session.stream, session.volume)
+		self.attach_gate(session.stream, session.voice)
+
+	# params: discord.AudioSource stream, float volume
+	# return: discord.AudioSource
+	# volume first, then the DSP chain, so a limiter at the end of the chain holds its ceiling at any volume
+	def make_source(self, stream, volume):
+		return sound.make_dsp_chain(sound.GainStage(original=stream, volume=volume))
+
+	# params: discord.AudioSource stream, discord.VoiceClient voice
+	# lets the stream pause and resume voice while it's silent; mixers don't have a gate of their own
+	def attach_gate(self, stream, voice):
+		if getattr(stream, "gate", None) is not None and voice not in stream.gate.voices:
+			stream.gate.voices.append(voice)
+
+	# params: discord.AudioSource stream, discord.VoiceClient voice
+	def detach_gate(self, stream, voice):
+		if getattr(stream, "gate", None) is not None and voice in stream.gate.voices:
+			stream.gate.voices.remove(voice)
+
+	# params: GuildSession session
+	# return: discord.AudioSource
+	def create_stream(self, session):
+		if self.use_mixer:
+			return self.create_mixer()
+		elif self.use_vban:
+			stream = sound.VBANStream(session.stream_name)
+			stream.start_vban()
+			return stream
 		else:
 			# device id
 			self.device_id = config.get_config_int("Audio", "device_id")
-			self.stream = sound.PCMStream()
-			self.stream.change_device(self.device_id)
-			
-		# float vol	
-		vol = config.get_config_float("Audio", "volume")
-		
-		if self.voice.is_playing():
-			self.voice.stop()
-		
-		self.voice.play(self.stream)
-		self.voice.source = discord.PCMVolumeTransformer(original=self.stream, volume=vol)
+			stream = sound.PCMStream()
+			stream.change_device(self.device_id)
+			return stream
+
+	# return: sound.MixerStream
+	def create_mixer(self):
+		mixer = sound.MixerStream()
+		# List[str] stream_names
+		stream_names = [name for name in config.get_config_list("Mixer", "vban_streams") if name != ""]
+		# List[float] gains
+		gains = [float(gain) for gain in config.get_config_list("Mixer", "vban_gains") if gain != ""]
+		for i, stream_name in enumerate(stream_names):
+			stream = sound.VBANStream(stream_name)
+			stream.start_vban()
+			mixer.add_input(stream, gains[i] if i < len(gains) else 1.0)
+			logging.info("Mixing in VBAN stream \"{}\"".format(stream_name))
+		# int device_id
+		# -1 leaves the local device out of the mix
+		device_id = config.get_config_int("Mixer", "device_id")
+		if device_id >= 0:
+			stream = sound.PCMStream()
+			stream.change_device(device_id)
+			mixer.add_input(stream, config.get_config_float("Mixer", "device_gain"))
+			logging.info("Mixing in audio device {}".format(device_id))
+		return mixer
 
 	# params: int new_id
 	# return boolean
 	def change_device(self, new_id):
-		if not self.use_vban:
+		if not self.use_vban and not self.use_mixer:
 			if new_id != self.device_id:
 				# sounddevice.DeviceList device_list
 				device_list = sound.query_devices()
@@ -66,7 +167,13 @@ class Dap_Bot(commands.Bot):
 				device_count = len(device_list)
 				if new_id >= 0 and new_id < device_count:
 					self.device_id = new_id
-					self.stream.change_device(new_id)
+					# List[sound.PCMStream] restarted
+					# when broadcasting, every guild shares one stream; reopen it once, not once per guild
+					restarted = []
+					for session in self.sessions.values():
+						if isinstance(session.stream, sound.PCMStream) and not any(session.stream is stream for stream in restarted):
+							session.stream.change_device(new_id)
+							restarted.append(session.stream)
 					config.set_config("Audio", "device_id", new_id)
 					logging.info("Device {} selected".format(new_id))
 					return True
@@ -76,57 +183,102 @@ class Dap_Bot(commands.Bot):
 		else:
 			return False
 
-	# params: float volume
+	# params: int guild_id, float volume
 	# return: boolean
-	def change_volume(self, volume):
+	def change_volume(self, guild_id, volume):
 		if volume >= 0.0 and volume <= 2.0:
-			if self.voice is not None and self.voice.source is not None:
-				self.voice.source.volume = volume
+			# GuildSession session
+			session = self.get_session(guild_id)
+			if self.broadcast is not None:
+				# everyone hears the same encoded audio, so the volume is everyone's
+				self.broadcast.source.volume = volume
+				for other in self.sessions.values():
+					other.volume = volume
+			elif session.voice is not None and session.voice.source is not None:
+				session.voice.source.volume = volume
+			session.volume = volume
+			# also the starting volume for guilds we join from now on
 			config.set_config("Audio", "volume", volume)
 			return True
 		return False
 
 	#params: Discord.VoiceChannel channel
 	async def join_voice_channel(self, channel):
+		# GuildSession session
+		session = self.get_session(channel.guild.id)
 		if config.get_config_bool("System", "ipv6"):
-			self.voice = await channel.connect(timeout=config.get_config_float("System", "voice_timeout"), reconnect=True, cls=IPv6VoiceClient)
+			session.voice = await channel.connect(timeout=config.get_config_float("System", "voice_timeout"), reconnect=True, cls=IPv6VoiceClient)
 		else:
-			self.voice = await channel.connect(timeout=config.get_config_float("System", "voice_timeout"), reconnect=True)
-		if self.voice is None:
+			session.voice = await channel.connect(timeout=config.get_config_float("System", "voice_timeout"), reconnect=True)
+		if session.voice is None:
 			raise discord.LoginFailure
-		elif self.voice.is_connected() is False:
-			await self.voice.disconnect()
-			self.voice = None
+		elif session.voice.is_connected() is False:
+			await session.voice.disconnect()
+			session.voice = None
 			raise discord.LoginFailure
 		else:
-			self.start_stream()
+			self.start_stream(session)
 
-	async def leave_voice_channel(self):
-		if self.voice is not None:
-			connection_error = not self.voice.is_connected()
-			await self.voice.disconnect(force = connection_error)
+	# params: int guild_id
+	async def leave_voice_channel(self, guild_id):
+		# GuildSession session
+		session = self.get_session(guild_id)
+		# discord.VoiceClient voice
+		voice = session.voice
+		if session.voice is not None:
+			connection_error = not session.voice.is_connected()
+			await session.voice.disconnect(force = connection_error)
 			if connection_error:
-				logging.error("Trying to disconnect from a voice channel but voice client's state is {}".format(self.voice._connection.state))
-			self.voice = None
+				logging.error("Trying to disconnect from a voice channel but voice client's state is {}".format(session.voice._connection.state))
+			session.voice = None
 		else:
 			# Handles case where VoiceChannel.connect() hasn't returned
-			# Kind of a shotgun-blast, but we're just going to get rid of any voice clients that aren't fully connected
+			# We're just going to get rid of this guild's voice client if it isn't fully connected
 			# This prevents the bot from getting "stuck" in the voice channel
 			logging.error("Trying to disconnect from a voice channel without known voice client.")
-			logging.info("Attempting to clean up bad voice client(s).")
-			for voice_client in self.voice_clients:
-				if not voice_client.is_connected():
-					await voice_client.disconnect(force = True)
-		if self.stream is not None:
-			self.stream.cleanup()
-			self.stream = None
-
-	def reset_stream(self):
-		if self.voice is not None:
-			if self.stream is not None:
-				self.stream.cleanup()
-			if self.voice is not None and self.voice.source is not None:
-				self.start_stream()
+			logging.info("Attempting to clean up bad voice client.")
+			# discord.Guild guild
+			guild = self.get_guild(guild_id)
+			if guild is not None and guild.voice_client is not None and not guild.voice_client.is_connected():
+				await guild.voice_client.disconnect(force = True)
+		self.detach_gate(session.stream, voice)
+		if self.broadcast is not None:
+			session.stream = None
+			if any(other.voice is not None for other in self.sessions.values()):
+				# still broadcasting to other guilds
+				return
+			self.broadcast.close()
+			self.broadcast = None
+			self.broadcast_stream = None
+		if session.stream is not None:
+			session.stream.cleanup()
+			session.stream = None
+
+	# params: int guild_id
+	def reset_stream(self, guild_id):
+		# GuildSession session
+		session = self.get_session(guild_id)
+		if self.broadcast is not None:
+			# the old stream lets go of its device or VBAN route first, then the new one is swapped in underneath every listener
+			self.broadcast.set_source(None)
+			stream = self.create_stream(session)
+			self.broadcast_stream = stream
+			self.broadcast.set_source(self.make_source(stream, session.volume))
+			for other in self.sessions.values():
+				if other.voice is not None:
+					self.detach_gate(other.stream, other.voice)
+					other.stream = stream
+					self.attach_gate(stream, other.voice)
+					# the new gate starts out open, so its on_input() never resumes a player the old gate paused, and a
+					# paused player never reads, so nothing else would either; resume it here and let the new gate pause
+					# it again if it's still quiet
+					if other.voice.is_paused():
+						other.voice.resume()
+		elif session.voice is not None:
+			if session.stream is not None:
+				session.stream.cleanup()
+			if session.voice.source is not None:
+				self.start_stream(session)
 
 	def queue_message(self, guild_id: int, channel_id: int, message: str, delay: int):
 		asyncio.create_task(self.post_queued_message(guild_id, channel_id, message, delay))
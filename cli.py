@@ -112,7 +112,7 @@ class VoiceCog(commands.Cog, name="Voice Commands"):
 		# Discord.VoiceChannel channels
 		channel = get_current_voice_channel(context)
 		if channel is not None:
-			await context.bot.leave_voice_channel()
+			await context.bot.leave_voice_channel(context.guild.id)
 
 			logging.info("Left channel {}".format(channel.name))
 			await context.send("Left channel {}.".format(channel.name))
@@ -125,12 +125,12 @@ class VoiceCog(commands.Cog, name="Voice Commands"):
 		if vol is None:
 			# Respond with current volume.
 			# int cur_volume
-			cur_volume = int(config.get_config_float("Audio", "volume") * 100.0)
+			cur_volume = int(round(context.bot.get_session(context.guild.id).volume * 100.0))
 			logging.info("Current volume requested")
 			await context.send("Volume is currently set to {}%.".format(cur_volume))
 		else:
 			float_vol = float(vol) / 100.0
-			if context.bot.change_volume(float_vol):
+			if context.bot.change_volume(context.guild.id, float_vol):
 				logging.info("Volume changed")
 				await context.send("Volume changed to {}%".format(vol))
 			else:
@@ -166,6 +166,9 @@ class VoiceCog(commands.Cog, name="Voice Commands"):
 		# String message
 		message = "Current Status:"
 
+		# bot.GuildSession session
+		session = context.bot.get_session(context.guild.id)
+
 		# Find current voice channel
 		# Discord.VoiceChannel channel
 		channel = get_current_voice_channel(context)
@@ -174,13 +177,29 @@ class VoiceCog(commands.Cog, name="Voice Commands"):
 		else:
 			message = message + "\nNot currently connected to a voice channel."
 
-		if context.bot.use_vban:
-			message = message + "\nListening for VBAN stream \"{}\"".format(config.get_config_string("VBAN", "stream_name"))
+		if context.bot.use_mixer:
+			# List[discord.AudioSource] inputs
+			inputs = session.stream.inputs() if session.stream is not None else []
+			message = message + "\nMixing {} audio sources".format(len(inputs))
+			for source in inputs:
+				if isinstance(source, sound.VBANStream):
+					state = "active" if source.stream_buffer else "not detected"
+					message = message + "\n- VBAN stream \"{}\" is {}".format(source.stream_name, state)
+				else:
+					message = message + "\n- Audio device {}".format(config.get_config_int("Mixer", "device_id"))
+		elif context.bot.use_vban:
+			message = message + "\nListening for VBAN stream \"{}\"".format(session.stream_name if session.stream is None else session.stream.stream_name)
 			if channel is not None:
-				if context.bot.voice is None or context.bot.voice.is_connected() is False:
+				if session.voice is None or session.voice.is_connected() is False:
 					message = message + "\nError in voice channel connection.  Cannot transmit audio."
-				elif context.bot.stream.stream_buffer:
+				elif session.stream is not None and session.stream.stream_buffer:
 					message = message + "\nThe VBAN stream is active.  Transmitting audio to the voice channel."
+					if session.stream.catchups > 0:
+						message = message + "\nThe VBAN buffer has overfilled {} times; {} frames dropped, {} sped up and {:.0f} ms cut to catch up.".format(session.stream.catchups, session.stream.catchup_dropped, session.stream.catchup_compressed, session.stream.catchup_cut_ms)
+					# str redundancy
+					redundancy = session.stream.route.redundancyStats() if session.stream.route is not None else None
+					if redundancy is not None:
+						message = message + "\nVBAN {}.".format(redundancy)
 				else:
 					message = message + "\nNo incoming VBAN stream detected.  Double-check the stream name and IP address."					
 		else:
@@ -189,6 +208,8 @@ class VoiceCog(commands.Cog, name="Voice Commands"):
 				# dict device
 				device = sound.get_device(context.bot.device_id)
 				message = message + "\nCurrent audio device is [{}] {}".format(context.bot.device_id, device["name"])
+				if isinstance(session.stream, sound.PCMStream):
+					message = message + "\nCapture overruns: {}, underruns: {}".format(session.stream.overruns, session.stream.underruns)
 			except sound.DeviceNotFoundError:
 				logging.exception("exception in sound.get_device()")
 				message = message + "\nInvalid audio device.  Please check the list of audio devices with !devices and set a new one using !set_device."
@@ -229,17 +250,19 @@ class VoiceCog(commands.Cog, name="Voice Commands"):
 	@commands.command(brief="Changes VBAN source IP and stream name.", description="Changes which IP address to listen from and stream identifier when running in VBAN mode.")
 	async def vban_change_stream(self, context, new_ip: str, stream_name: typing.Optional[str]):
 		if context.bot.use_vban:
+			# bot.GuildSession session
+			session = context.bot.get_session(context.guild.id)
 			config.set_config("VBAN", "incoming_host", new_ip)
 			if stream_name is not None:
+				session.stream_name = stream_name
+				# also the stream for guilds we join from now on
 				config.set_config("VBAN", "stream_name", stream_name)
-			context.bot.reset_stream()
+			context.bot.reset_stream(context.guild.id)
 
 			# str output_name
-			output_name = stream_name
-			if output_name is None:
-				output_name = config.get_config_string("VBAN", "stream_name")
+			output_name = session.stream_name
 			
-			if context.bot.voice is not None:
+			if session.voice is not None:
 				await context.send("Audio stream reset: now listening to {} on stream \"{}\"".format(new_ip, output_name))
 			else:
 				await context.send("Stream IP is now {}, with stream \"{}\"".format(new_ip, output_name))
@@ -479,12 +502,12 @@ class SecretRollCog(commands.Cog, name="Secret Roll Commands"):
 # params: Discord.ext.commands.Context context
 # return Discord.VoiceChannel
 def get_current_voice_channel(context):
-	for client in context.bot.voice_clients:
-		# Discord.VoiceChannel channel
-		channel = client.channel
-		if channel.guild == context.guild:
-			return channel
-	return None
+	# Discord.VoiceClient voice_client
+	# discord.py keeps each guild's voice client on the guild itself, so there's no need to search for it
+	voice_client = context.guild.voice_client
+	if voice_client is None:
+		return None
+	return voice_client.channel
 
 # params: String process_name
 # return boolean
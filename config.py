@@ -32,6 +32,9 @@ def setup_config(cfg_file_name):
 	use_default = not exists(cfg_file_name)
 	if use_default:
 		use_file_name = cfg_file_name + ".default"
+	else:
+		# load the defaults underneath the existing file so that settings added since it was written still have values
+		config.read(cfg_file_name + ".default")
 
 	config.read(use_file_name)
 	if config.sections == []:
@@ -6,6 +6,8 @@ import config
 import sounddevice as sd
 import threading
 import logging
+import time
+import numpy as np
 from pprint import pformat
 
 DEFAULT = 0
@@ -14,6 +16,390 @@ sd.default.dtype = "int16"
 sd.default.latency = "low"
 sd.default.samplerate = 48000
 
+class FrameRing(object):
+	"""Fixed-capacity ring buffer of PCM audio, sized in whole Discord frames
+
+	Safe for exactly one writer thread and one reader thread without a lock.  Each side
+	only ever advances its own counter, and only after the bytes have been copied, so the
+	other side never sees a position whose data isn't there yet.
+	"""
+	# params: int frame_count, int frame_len
+	def __init__(self, frame_count, frame_len):
+		# int frame_len
+		self.frame_len = frame_len
+		# int capacity
+		# in bytes; always a whole number of frames
+		self.capacity = frame_count * frame_len
+		# bytearray buffer
+		# allocated once; never resized
+		self.buffer = bytearray(self.capacity)
+		# memoryview view
+		self.view = memoryview(self.buffer)
+		# int write_count
+		# total bytes ever written; only advanced by the writer
+		self.write_count = 0
+		# int read_count
+		# total bytes ever read; only advanced by the reader
+		self.read_count = 0
+
+	# return: int
+	def __len__(self):
+		return self.write_count - self.read_count
+
+	# return: int
+	def free(self):
+		return self.capacity - len(self)
+
+	# params: bytes-like data
+	# return: int
+	# copies as much of data as will fit and returns the number of bytes written
+	def write(self, data):
+		# memoryview src
+		src = memoryview(data).cast("B")
+		# int count
+		count = min(len(src), self.free())
+		# int start
+		start = self.write_count % self.capacity
+		# int first
+		# bytes that fit before we wrap around to the front of the buffer
+		first = min(count, self.capacity - start)
+		self.view[start:start + first] = src[0:first]
+		if count > first:
+			self.view[0:count - first] = src[first:count]
+		self.write_count += count
+		return count
+
+	# params: writable bytes-like dest
+	# return: int
+	# fills dest from the front of the buffer and returns the number of bytes copied
+	def read_into(self, dest):
+		# memoryview dst
+		dst = memoryview(dest).cast("B")
+		# int count
+		count = min(len(dst), len(self))
+		# int start
+		start = self.read_count % self.capacity
+		# int first
+		first = min(count, self.capacity - start)
+		dst[0:first] = self.view[start:start + first]
+		if count > first:
+			dst[first:count] = self.view[0:count - first]
+		self.read_count += count
+		return count
+
+	# throws away everything buffered; like the other read methods, only the reader may call this
+	def clear(self):
+		self.read_count = self.write_count
+
+	# params: int count
+	# throws away the first count bytes, or everything if there are fewer
+	def skip(self, count):
+		self.read_count += min(count, len(self))
+
+	# params: int count
+	# return: bytes
+	def read(self, count):
+		count = min(count, len(self))
+		# int start
+		start = self.read_count % self.capacity
+		if start + count <= self.capacity:
+			# contiguous; a single copy straight out of the ring
+			data = self.view[start:start + count].tobytes()
+			self.read_count += count
+			return data
+		# bytearray data
+		data = bytearray(count)
+		self.read_into(data)
+		return bytes(data)
+
+
+class AdaptiveLatency(object):
+	"""Chooses how much audio VBANStream buffers, based on measured network jitter and underruns"""
+	# float frame_ms
+	# the least we can ever buffer is one Discord frame
+	frame_ms = 20.0
+	# float jitter_multiple
+	# how many times the smoothed jitter we hold in reserve
+	jitter_multiple = 4.0
+	# float underrun_step
+	# milliseconds added to the target on every underrun
+	underrun_step = 20.0
+	# float decay_step
+	# milliseconds of underrun allowance given back per update once playback has been stable
+	decay_step = 5.0
+	# int update_frames
+	# we re-evaluate the target once a second
+	update_frames = 50
+	# int stable_frames
+	# thirty seconds without an underrun counts as stable
+	stable_frames = 1500
+
+	# params: float target, float minimum, float maximum
+	# all in milliseconds
+	def __init__(self, target, minimum, maximum):
+		# float minimum
+		self.minimum = minimum
+		# float maximum
+		self.maximum = maximum
+		# float target
+		self.target = self.clamp(target)
+		# float underrun_allowance
+		# extra milliseconds we've learned to keep on top of what the jitter alone calls for
+		self.underrun_allowance = 0.0
+		# int underruns
+		self.underruns = 0
+		# int frames
+		self.frames = 0
+		# int frames_since_underrun
+		self.frames_since_underrun = 0
+
+	# params: float ms
+	# return: float
+	def clamp(self, ms):
+		return min(max(ms, self.minimum), self.maximum)
+
+	# params: float jitter
+	# jitter is in seconds, straight from vban.VBAN_JitterBuffer
+	def on_underrun(self, jitter):
+		self.underruns += 1
+		self.frames_since_underrun = 0
+		self.underrun_allowance += AdaptiveLatency.underrun_step
+		self.retarget(jitter, "underrun, {} so far".format(self.underruns))
+
+	# params: float jitter
+	# called once per frame played
+	def on_frame(self, jitter):
+		self.frames += 1
+		self.frames_since_underrun += 1
+		if self.frames % AdaptiveLatency.update_frames != 0:
+			return
+
+		# str reason
+		reason = "jitter is {:.1f} ms".format(jitter * 1000.0)
+		if self.frames_since_underrun >= AdaptiveLatency.stable_frames and self.underrun_allowance > 0.0:
+			self.underrun_allowance = max(0.0, self.underrun_allowance - AdaptiveLatency.decay_step)
+			reason = "no underruns for {} s".format(self.frames_since_underrun // 50)
+		self.retarget(jitter, reason)
+
+	# params: float jitter, str reason
+	def retarget(self, jitter, reason):
+		# float desired
+		desired = self.clamp(AdaptiveLatency.frame_ms + jitter * 1000.0 * AdaptiveLatency.jitter_multiple + self.underrun_allowance)
+		if abs(desired - self.target) >= 1.0:
+			logging.info("VBAN latency target {:.0f} ms -> {:.0f} ms ({})".format(self.target, desired, reason))
+			self.target = desired
+
+
+class DriftCompensator(object):
+	"""Nudges the playout rate so the sender's clock and Discord's 20 ms cadence don't slowly drift apart
+
+	Watches how full the buffer is over time and, when it strays from the latency target, plays slightly faster or
+	slower by resampling each frame with linear interpolation.  The correction is capped at a few tenths of a percent,
+	which is too small to hear as a change in pitch.
+	"""
+	# int frame_samples
+	# stereo samples per Discord frame
+	frame_samples = 960
+	# float smoothing
+	# weight of each new depth reading; about a one second time constant at 50 frames per second
+	smoothing = 0.02
+	# float deadband
+	# milliseconds either side of the target where we leave the audio untouched
+	deadband = 5.0
+	# float gain
+	# rate correction per millisecond outside the deadband
+	gain = 0.0001
+	# float max_correction
+	max_correction = 0.003
+
+	def __init__(self):
+		# float ratio
+		# input samples consumed per output sample
+		self.ratio = 1.0
+		# float phase
+		# input position of the next output sample, counted from the last input sample of the previous frame
+		# playing straight through, the next output sample is simply the next input sample, so this is 1
+		self.phase = 1.0
+		# np.ndarray last
+		# the last input sample of the previous frame, so interpolation is continuous across frames
+		self.last = np.zeros(2, dtype=np.float32)
+		# float depth
+		# smoothed buffer depth in milliseconds; None until the first reading
+		self.depth = None
+		# np.ndarray steps
+		self.steps = np.arange(DriftCompensator.frame_samples, dtype=np.float64)
+
+	def reset(self):
+		self.ratio = 1.0
+		self.phase = 1.0
+		self.last[:] = 0
+		self.depth = None
+
+	# params: float depth_ms, float target_ms
+	def update(self, depth_ms, target_ms):
+		if self.depth is None:
+			self.depth = depth_ms
+		else:
+			self.depth += (depth_ms - self.depth) * DriftCompensator.smoothing
+
+		# float error
+		error = self.depth - target_ms
+		if abs(error) <= DriftCompensator.deadband:
+			self.ratio = self.settling_ratio()
+		else:
+			error -= DriftCompensator.deadband if error > 0 else -DriftCompensator.deadband
+			correction = min(max(error * DriftCompensator.gain, -DriftCompensator.max_correction), DriftCompensator.max_correction)
+			self.ratio = 1.0 + correction
+
+	# return: boolean
+	def is_passthrough(self):
+		return self.ratio == 1.0 and self.phase == 1.0
+
+	# return: float
+	# the ratio that plays the next frame straight through; if a correction has left us between input samples, it's
+	# the one that lands the frame's end back on a whole sample, a hair under a tenth of a percent fast for a single
+	# frame, so every frame after it can pass through untouched
+	def settling_ratio(self):
+		if self.phase == 1.0:
+			return 1.0
+		# int count
+		# the input that frame will consume: enough for its last output sample, just as input_samples() works it out
+		count = np.ceil(self.phase + DriftCompensator.frame_samples - 1 - 1e-9)
+		return (count + 1.0 - self.phase) / DriftCompensator.frame_samples
+
+	# return: int
+	# how many input samples the next frame will consume
+	def input_samples(self):
+		if self.is_passthrough():
+			return DriftCompensator.frame_samples
+		# the last output sample lands at phase + 959 * ratio; we need input up to and including that position
+		return int(np.ceil(self.phase + (DriftCompensator.frame_samples - 1) * self.ratio - 1e-9))
+
+	# params: bytes-like pcm
+	# pcm must hold the last few bytes of a frame that was played without resampling
+	def track(self, pcm):
+		self.last[:] = np.frombuffer(pcm, dtype=np.int16)[-2:]
+
+	# params: bytes-like pcm
+	# return: bytes
+	# pcm must hold exactly input_samples() stereo samples
+	def resample(self, pcm):
+		# np.ndarray new
+		new = np.frombuffer(pcm, dtype=np.int16).reshape(-1, 2)
+		# int count
+		count = len(new)
+		# np.ndarray block
+		# index 0 is the carried-over sample, indices 1..count are this frame's input
+		block = np.empty((count + 1, 2), dtype=np.float32)
+		block[0] = self.last
+		block[1:] = new
+
+		# np.ndarray pos
+		pos = np.clip(self.phase + self.steps * self.ratio, 0.0, count)
+		# np.ndarray left
+		left = pos.astype(np.intp)
+		right = np.minimum(left + 1, count)
+		frac = (pos - left).astype(np.float32)[:, None]
+		out = block[left] + (block[right] - block[left]) * frac
+
+		self.phase = self.phase + DriftCompensator.frame_samples * self.ratio - count
+		if abs(self.phase - 1.0) < 1e-9:
+			self.phase = 1.0
+		self.last[:] = block[count]
+		return np.clip(np.rint(out), -32768, 32767).astype(np.int16).tobytes()
+
+
+class SilenceGate(object):
+	"""Stops transmitting while a stream is silent (discontinuous transmission) and starts again the moment it isn't
+
+	read() hands each frame to on_frame() on the player thread.  Once frames have been quiet for the hangover, the
+	voice clients playing the stream are paused, so discord.py stops encoding and sending until they're resumed.  The
+	thread that produces the audio passes everything it gets through on_input(), which throws away silence while
+	paused and resumes the voice clients as soon as there's something to hear.
+	"""
+	# float peak_margin
+	# decibels above the RMS threshold a single sample may reach before the frame no longer counts as quiet
+	peak_margin = 20.0
+
+	# params: float threshold_db, float hangover_ms
+	def __init__(self, threshold_db, hangover_ms):
+		# float rms_threshold
+		# in 16-bit sample units
+		self.rms_threshold = 32768.0 * 10.0 ** (threshold_db / 20.0)
+		# int peak_threshold
+		self.peak_threshold = int(32768.0 * 10.0 ** ((threshold_db + SilenceGate.peak_margin) / 20.0))
+		# int hangover_frames
+		self.hangover_frames = max(1, int(hangover_ms / AdaptiveLatency.frame_ms))
+		# int quiet_frames
+		self.quiet_frames = 0
+		# List[discord.VoiceClient] voices
+		# everything playing this stream; with none, the gate never closes
+		self.voices = []
+		# bool paused
+		self.paused = False
+		# int pauses
+		self.pauses = 0
+
+	# params: bytes-like pcm
+	# return: boolean
+	def is_quiet(self, pcm):
+		samples = np.frombuffer(pcm, dtype=np.int16)
+		if len(samples) == 0:
+			return True
+		if max(int(samples.max()), -int(samples.min())) >= self.peak_threshold:
+			return False
+		floats = samples.astype(np.float32)
+		return float(np.dot(floats, floats)) < self.rms_threshold * self.rms_threshold * len(samples)
+
+	# params: bytes-like pcm
+	# return: boolean
+	# called from read() with each frame; returns whether the gate has just closed
+	def on_frame(self, pcm):
+		if len(self.voices) == 0:
+			# nothing to pause, so don't bother looking
+			return False
+		if not self.is_quiet(pcm):
+			self.quiet_frames = 0
+			return False
+		self.quiet_frames += 1
+		if self.quiet_frames < self.hangover_frames:
+			return False
+		if self.paused:
+			# only a voice client that started listening after we closed is still reading; pause it with the rest
+			for voice in self.voices:
+				if not voice.is_paused():
+					voice.pause()
+			return False
+		# pause before raising the flag; if sound turns up in between, on_input() still sees us as running and the
+		# next packet resumes us instead
+		for voice in self.voices:
+			voice.pause()
+		self.paused = True
+		self.pauses += 1
+		return True
+
+	# params: bytes-like pcm
+	# return: boolean
+	# called from the producing thread with each piece of incoming audio; returns whether to keep it
+	def on_input(self, pcm):
+		if not self.paused:
+			return True
+		if self.is_quiet(pcm):
+			return False
+		self.paused = False
+		self.quiet_frames = 0
+		for voice in self.voices:
+			voice.resume()
+		return True
+
+# return: SilenceGate
+# None if DTX is turned off
+def make_silence_gate():
+	if not config.get_config_bool("Audio", "dtx"):
+		return None
+	return SilenceGate(config.get_config_float("Audio", "silence_threshold_db"), config.get_config_float("Audio", "silence_hangover_ms"))
+
+
 class VBANStream(discord.AudioSource):
 	# int bytes_per_frame
 	# 4 bytes per sample (stereo 16-bit audio)
@@ -21,83 +407,222 @@ class VBANStream(discord.AudioSource):
 	# int bytes_per_sec
 	# this is dictated by Discord; each frame is 20 ms
 	bytes_per_sec = bytes_per_frame * 50
+	# int buffer_frames
+	# ten seconds of audio
+	buffer_frames = 500
+	# float catchup_ratio
+	# how much faster than real time we play while catching up and there's no quiet frame to drop; 2 ms gained per
+	# frame, at the cost of raising the pitch by about a semitone and a half while it lasts
+	catchup_ratio = 1.1
+	# int catchup_compress_frames
+	# the most frames a single catch-up plays fast; half a second sharp is about as much as goes unnoticed, so
+	# whatever's still over after that is cut in one go
+	catchup_compress_frames = 25
+	# int catchup_drops
+	# the most quiet frames we'll skip over in a single read
+	catchup_drops = 5
+	# float catchup_quiet_db
+	# frames below this level can be dropped without anyone noticing
+	catchup_quiet_db = -45.0
 
-	def __init__(self):
+	# params: str stream_name
+	# stream_name defaults to the one in the config file
+	def __init__(self, stream_name=None):
 		discord.AudioSource.__init__(self)
-		# bytearray stream_buffer
+		# str stream_name
+		self.stream_name = stream_name
+		# FrameRing stream_buffer
 		# holds ten seconds of audio as a FIFO queue
-		# insert on right, remove on left
-		self.stream_buffer = bytearray()
+		self.stream_buffer = FrameRing(VBANStream.buffer_frames, VBANStream.bytes_per_frame)
 		# int sample_rate
 		self.sample_rate = sd.default.samplerate
 		# asyncio.Task recv_task
 		self.recv_task = None
 		# boolean verbose
 		self.verbose = config.get_config_bool("VBAN", "verbose")
-		# threading.Lock buffer_lock
-		self.buffer_lock = threading.Lock()
 		# bool buffering
-		self.buffering = False
-		# float buffering_min
-		# if the buffer has less than this many seconds worth of audio data, buffering will be enabled
-		self.buffering_min = config.get_config_float("VBAN", "buffering_min")
-		# float buffering_max
-		# if we are buffering, when the buffer reaches this many seconds worth of audio data, buffering will be disabled
-		self.buffering_max = config.get_config_float("VBAN", "buffering_max")
+		# starts out true so that we build up to the latency target before playing anything
+		self.buffering = True
+		# AdaptiveLatency latency
+		# after an underrun, we wait until the buffer holds latency.target milliseconds of audio before playing again
+		self.latency = AdaptiveLatency(
+			config.get_config_float("VBAN", "latency_target_ms"),
+			config.get_config_float("VBAN", "latency_min_ms"),
+			config.get_config_float("VBAN", "latency_max_ms"))
+		# DriftCompensator drift
+		# None if drift compensation is turned off
+		self.drift = DriftCompensator() if config.get_config_bool("VBAN", "drift_compensation") else None
+		# SilenceGate gate
+		# None if DTX is turned off
+		self.gate = make_silence_gate()
+		# float ceiling_ms
+		# past this much buffered audio we catch up; never below what the latency target can ask for
+		self.ceiling_ms = max(config.get_config_float("VBAN", "latency_ceiling_ms"), self.latency.maximum + 2 * AdaptiveLatency.frame_ms)
+		# bool catching_up
+		self.catching_up = False
+		# SilenceGate quiet
+		# only used to tell whether a frame is quiet enough to drop; it never pauses anything
+		self.quiet = SilenceGate(VBANStream.catchup_quiet_db, AdaptiveLatency.frame_ms)
+		# DriftCompensator catchup_resampler
+		# for time compression when drift compensation is turned off; otherwise we borrow drift's
+		self.catchup_resampler = DriftCompensator() if self.drift is None else self.drift
+		# int catchups
+		# times we've gone over the ceiling
+		self.catchups = 0
+		# int catchup_dropped, catchup_compressed
+		# frames dropped or compressed, over all catch-ups
+		self.catchup_dropped = 0
+		self.catchup_compressed = 0
+		# float catchup_cut_ms
+		# audio cut once compression had run its course, over all catch-ups
+		self.catchup_cut_ms = 0.0
+		# int event_dropped, event_compressed
+		# the same, for the catch-up in progress
+		self.event_dropped = 0
+		self.event_compressed = 0
+		# int event_cut
+		# in bytes
+		self.event_cut = 0
 		# vban.VBAN_Recv receiver
+		# shared with any other VBANStream on the same port
 		self.receiver = None
+		# vban.VBAN_RecvRoute route
+		# our stream on that receiver
+		self.route = None
 
 	def read(self):
 		# int frame_len
 		frame_len = VBANStream.bytes_per_frame
-
-		self.buffer_lock.acquire()
-		# ENTER CRITICAL SECTION
 		# int buffer_len
 		buffer_len = len(self.stream_buffer)
+		# vban.VBAN_RecvRoute route
+		route = self.route
+		# float jitter
+		jitter = route.jitterBuffer.jitter if route is not None else 0.0
+		# int needed
+		# how many bytes this frame will consume; slightly more or less than a frame while correcting drift
+		needed = frame_len if self.drift is None else self.drift.input_samples() * 4
 
 		# enforce buffer constraints
-		if self.buffering and buffer_len > int(VBANStream.bytes_per_sec * self.buffering_max):
+		# lost packets are concealed upstream, so running dry really does mean the sender has stalled
+		if self.buffering and buffer_len >= int(VBANStream.bytes_per_sec * self.latency.target / 1000.0):
 			self.buffering = False
-		elif not self.buffering and buffer_len < int(VBANStream.bytes_per_sec * self.buffering_min):
+		elif not self.buffering and buffer_len < needed:
 			self.buffering = True
+			self.latency.on_underrun(jitter)
+			if self.drift is not None:
+				self.drift.reset()
+		self.latency.on_frame(jitter)
 
 		if self.buffering:
-			# END CRITICAL SECTION
-			self.buffer_lock.release()
 			# we don't have enough audio to present a 20 ms frame; return the corresponding amount of silence instead
 			if self.verbose:
 				logging.info("Insufficient audio data in VBAN buffer; transmitting silence")
 			# the bytes(int) constructor creates a zero-filled object of length equal to the param
-			return bytes(frame_len)
+			frame = bytes(frame_len)
+			if self.gate is not None:
+				self.gate.on_frame(frame)
+			return frame
+		elif self.catching_up or buffer_len > VBANStream.bytes_per_sec * self.ceiling_ms / 1000.0:
+			frame = self.catch_up(buffer_len)
+			if self.gate is not None:
+				self.gate.on_frame(frame)
+			return frame
 		else:
 			# bytes frame
-			frame = bytes(self.stream_buffer[0:frame_len])
-			# remove the frame bytes from the buffer before returning
-			del self.stream_buffer[0:frame_len]
-			# int new_len
-			new_len = len(self.stream_buffer)
+			frame = self.stream_buffer.read(needed)
+			if self.drift is not None:
+				if self.drift.is_passthrough():
+					self.drift.track(frame[-4:])
+				else:
+					frame = self.drift.resample(frame)
+				# update after consuming so the next frame's size reflects the newest reading
+				self.drift.update((buffer_len - needed) * 1000.0 / VBANStream.bytes_per_sec, self.latency.target)
 			if self.verbose:
-				logging.info("Removing {} bytes from VBAN buffer".format(frame_len))
-				logging.info("VBAN buffer now contains {} bytes".format(new_len))
-			# END CRITICAL SECTION
-			self.buffer_lock.release()
+				logging.info("Removing {} bytes from VBAN buffer".format(needed))
+				logging.info("VBAN buffer now contains {} bytes".format(len(self.stream_buffer)))
+			if self.gate is not None:
+				self.gate.on_frame(frame)
 			return frame
 
 
+	# params: int buffer_len
+	# return: bytes
+	# plays one frame while bringing the buffer back down to the latency target, by skipping quiet frames where there
+	# are any and playing slightly fast where there aren't, for a short while; past that, the excess is cut
+	def catch_up(self, buffer_len):
+		# int frame_len
+		frame_len = VBANStream.bytes_per_frame
+		# float target_len
+		target_len = VBANStream.bytes_per_sec * self.latency.target / 1000.0
+		# DriftCompensator resampler
+		resampler = self.catchup_resampler
+		if not self.catching_up:
+			self.catching_up = True
+			self.catchups += 1
+			self.event_dropped = 0
+			self.event_compressed = 0
+			self.event_cut = 0
+			logging.warning("VBAN buffer holds {:.0f} ms, over the {:.0f} ms ceiling; catching up ({} so far)".format(
+				buffer_len * 1000.0 / VBANStream.bytes_per_sec, self.ceiling_ms, self.catchups))
+			if resampler is not self.drift:
+				resampler.reset()
+
+		# bool desperate
+		# this far over, loud frames get dropped too; better a glitch than seconds of delay
+		desperate = buffer_len > 2 * VBANStream.bytes_per_sec * self.ceiling_ms / 1000.0
+		resampler.ratio = VBANStream.catchup_ratio
+		# int needed
+		needed = resampler.input_samples() * 4
+		frame = self.stream_buffer.read(frame_len)
+		for i in range(VBANStream.catchup_drops):
+			if len(self.stream_buffer) < needed or len(self.stream_buffer) + frame_len <= target_len:
+				break
+			if not desperate and not self.quiet.is_quiet(frame):
+				break
+			frame = self.stream_buffer.read(frame_len)
+			self.event_dropped += 1
+
+		if self.event_compressed >= VBANStream.catchup_compress_frames and len(self.stream_buffer) > target_len:
+			# we've played fast for long enough; one cut is less noticeable than carrying on sharp
+			# int cut
+			cut = int(len(self.stream_buffer) - target_len) // 4 * 4
+			self.stream_buffer.skip(cut)
+			self.event_cut += cut
+			resampler.track(frame[-4:])
+		elif len(self.stream_buffer) >= needed - frame_len and len(self.stream_buffer) + frame_len > target_len:
+			# squeeze a little more than a frame into this one
+			frame = resampler.resample(frame + self.stream_buffer.read(needed - frame_len))
+			self.event_compressed += 1
+		else:
+			resampler.track(frame[-4:])
+
+		if len(self.stream_buffer) <= target_len:
+			self.catching_up = False
+			resampler.ratio = 1.0
+			if self.drift is not None:
+				# the depth drift has been smoothing is from before we caught up
+				self.drift.depth = None
+			self.catchup_dropped += self.event_dropped
+			self.catchup_compressed += self.event_compressed
+			self.catchup_cut_ms += self.event_cut * 1000.0 / VBANStream.bytes_per_sec
+			logging.info("VBAN buffer back down to {:.0f} ms; dropped {} quiet frames, compressed {} and cut {:.0f} ms".format(
+				len(self.stream_buffer) * 1000.0 / VBANStream.bytes_per_sec, self.event_dropped, self.event_compressed, self.event_cut * 1000.0 / VBANStream.bytes_per_sec))
+		return frame
+
 	# params: bytes raw_pcm
 	def write(self, raw_pcm):
-		self.buffer_lock.acquire()
-		# ENTER CRITICAL SECTION
-		self.stream_buffer += raw_pcm
-		# int new_len
-		new_len = len(self.stream_buffer)
+		if self.gate is not None and not self.gate.on_input(raw_pcm):
+			# paused for silence; whatever's left in the buffer keeps our latency reserve for when sound returns
+			return
+		# int written
+		written = self.stream_buffer.write(raw_pcm)
+		if written < len(raw_pcm):
+			logging.warning("VBAN buffer full; dropped {} bytes".format(len(raw_pcm) - written))
 		if self.verbose:
-			logging.info("Recieved data from {}.".format(self.receiver.senderIp))
-			logging.info("Adding {} bytes to VBAN buffer".format(len(raw_pcm)))
-			logging.info("VBAN buffer now contains {} bytes".format(new_len))
-		# END CRITICAL SECTION
-		self.buffer_lock.release()
+			logging.info("Recieved data from {}.".format(self.route.senderIp or "any sender"))
+			logging.info("Adding {} bytes to VBAN buffer".format(written))
+			logging.info("VBAN buffer now contains {} bytes".format(len(self.stream_buffer)))
 
 	def cleanup(self):
 		self.stop_vban()
@@ -129,7 +654,9 @@ class VBANStream(discord.AudioSource):
 		# bool ipv6
 		ipv6 = config.get_config_bool("System", "ipv6")
 		# str stream_name
-		stream_name = config.get_config_string("VBAN", "stream_name")
+		stream_name = self.stream_name
+		if stream_name is None:
+			stream_name = config.get_config_string("VBAN", "stream_name")
 		
 		if host == "any":
 			# if we want any incoming host, then we pass None into VBAN_Recv
@@ -137,35 +664,702 @@ class VBANStream(discord.AudioSource):
 
 		try:
 			# vban.VBAN_Recv receiver
-			self.receiver = vban.VBAN_Recv(host, stream_name, port, 0, ipv6=ipv6, verbose=self.verbose, stream=self)
-			# str logging.infoed_ip
-			printed_ip = self.receiver.senderIp
+			self.receiver = get_vban_receiver(port)
+			# vban.VBAN_RecvRoute route
+			self.route = self.receiver.addRoute(host, stream_name, self)
+			# str printed_ip
+			printed_ip = self.route.senderIp
 			if host is None:
 				printed_ip = "[::/0]" if ipv6 else "0.0.0.0/0"
 			elif ipv6:
 				printed_ip = "[" + printed_ip + "]"
-			logging.info("VBAN receiver initalized on {}:{}!".format(printed_ip, port))
+			logging.info("Listening for VBAN stream \"{}\" from {} on port {}!".format(stream_name, printed_ip, port))
 
 			try:
-				while True:
-					try:
-						self.receiver.runforever()
-					except IndexError:
-						# we have nothing left to receive; let's wait a bit
-						await asyncio.sleep(0.02)
+				# the shared receiver does the work; we just stay attached until cancelled
+				await asyncio.get_running_loop().create_future()
 			except asyncio.CancelledError:
 				logging.info("VBAN task cancelled!")
-				self.receiver.quit()
 		except Exception as e:
 			logging.exception("Connection to {} failed.".format(host))
-		self.stream_buffer = bytearray()
-		self.reciever = None
+		if self.receiver is not None:
+			if self.route is not None:
+				self.receiver.removeRoute(self.route, self)
+			release_vban_receiver(port)
+		self.stream_buffer = FrameRing(VBANStream.buffer_frames, VBANStream.bytes_per_frame)
+		self.route = None
+		self.receiver = None
+
+
+# dict[int, vban.VBAN_Recv] vban_receivers
+# one receiver per port, shared by every VBANStream listening on that port
+vban_receivers = {}
+# dict[int, asyncio.Task] vban_receive_tasks
+vban_receive_tasks = {}
+
+# params: int port
+# return: vban.VBAN_Recv
+def get_vban_receiver(port):
+	# vban.VBAN_Recv receiver
+	receiver = vban_receivers.get(port)
+	if receiver is None:
+		receiver = vban.VBAN_Recv(None, None, port, 0,
+			ipv6=config.get_config_bool("System", "ipv6"),
+			verbose=config.get_config_bool("VBAN", "verbose"),
+			reorderWindow=config.get_config_int("VBAN", "reorder_window"),
+			rcvBuf=config.get_config_int("VBAN", "receive_buffer"))
+		vban_receivers[port] = receiver
+		vban_receive_tasks[port] = asyncio.create_task(run_vban_receiver(receiver, config.get_config_string("VBAN", "receive_mode")))
+		logging.info("VBAN receiver initalized on port {}!".format(port))
+	return receiver
+
+# params: int port
+# shuts the port's receiver down once no streams are left on it
+def release_vban_receiver(port):
+	# vban.VBAN_Recv receiver
+	receiver = vban_receivers.get(port)
+	if receiver is not None and len(receiver.routes) == 0:
+		logging.info("No VBAN streams left on port {}; closing receiver".format(port))
+		del vban_receivers[port]
+		vban_receive_tasks.pop(port).cancel()
+
+# params: vban.VBAN_Recv receiver, str receive_mode
+async def run_vban_receiver(receiver, receive_mode):
+	try:
+		if receive_mode == "poll":
+			while True:
+				try:
+					receiver.runforever()
+				except IndexError:
+					# we have nothing left to receive; let's wait a bit
+					await asyncio.sleep(0.02)
+		elif receive_mode == "thread":
+			# the receiver runs on its own; we just stay alive until cancelled
+			receiver.startThread()
+			await asyncio.get_running_loop().create_future()
+		else:
+			# packets get handled as they arrive; we just stay alive until cancelled
+			await receiver.listen()
+			await asyncio.get_running_loop().create_future()
+	except asyncio.CancelledError:
+		logging.info("VBAN receiver on port {} stopped".format(receiver.port))
+	except Exception:
+		logging.exception("VBAN receiver on port {} failed".format(receiver.port))
+	finally:
+		# the receiver thread only notices it's been stopped once its socket times out; wait for that off the loop
+		await asyncio.get_running_loop().run_in_executor(None, receiver.stopThread)
+		receiver.quit()
+
+
+class GainStage(discord.AudioSource):
+	"""Applies volume to another AudioSource; a drop-in for discord.PCMVolumeTransformer
+
+	Volume changes are ramped across one frame instead of jumping, so there's no click or zipper noise, and at unity
+	gain the frames pass through untouched.
+	"""
+	# int frame_samples
+	# stereo samples per Discord frame
+	frame_samples = 960
+
+	# params: discord.AudioSource original, float volume
+	def __init__(self, original, volume=1.0):
+		discord.AudioSource.__init__(self)
+		# discord.AudioSource original
+		self.original = original
+		# float target
+		# where the next frame's ramp ends up
+		self.target = max(volume, 0.0)
+		# float current
+		# the gain the last frame ended on
+		self.current = self.target
+		# np.ndarray steps
+		# 0 to 1 across a frame, once per channel, for building ramps
+		self.steps = np.repeat((np.arange(GainStage.frame_samples, dtype=np.float32) + 1.0) / GainStage.frame_samples, 2)
+		# np.ndarray ramp, scaled, out
+		# scratch space, so a frame allocates nothing but the bytes it returns
+		self.ramp = np.empty(GainStage.frame_samples * 2, dtype=np.float32)
+		self.scaled = np.empty(GainStage.frame_samples * 2, dtype=np.float32)
+		self.out = np.empty(GainStage.frame_samples * 2, dtype=np.int16)
+
+	@property
+	def volume(self):
+		return self.target
+
+	@volume.setter
+	def volume(self, value):
+		# picked up at the start of the next frame, on the player thread
+		self.target = max(value, 0.0)
+
+	def read(self):
+		frame = self.original.read()
+		# float target
+		target = self.target
+		# float current
+		current = self.current
+		if not frame or (target == 1.0 and current == 1.0):
+			return frame
+
+		samples = np.frombuffer(frame, dtype=np.int16)
+		if len(samples) != len(self.scaled):
+			# not a whole frame; unusual enough that it just gets the new gain straight away
+			self.current = target
+			return np.clip(np.rint(samples * np.float32(target)), -32768, 32767).astype(np.int16).tobytes()
+
+		# every step writes into the scratch arrays; NumPy's per-call overhead outweighs the arithmetic at this size
+		scaled = self.scaled
+		if target == current:
+			np.multiply(samples, np.float32(target), out=scaled)
+		else:
+			# ramp from where the last frame left off to the new gain
+			np.multiply(self.steps, np.float32(target - current), out=self.ramp)
+			np.add(self.ramp, np.float32(current), out=self.ramp)
+			np.multiply(samples, self.ramp, out=scaled)
+			self.current = target
+		np.rint(scaled, out=scaled)
+		if max(target, current) > 1.0:
+			# only turning it up can overflow
+			np.minimum(scaled, 32767.0, out=scaled)
+			np.maximum(scaled, -32768.0, out=scaled)
+		self.out[:] = scaled
+		return self.out.tobytes()
+
+	def cleanup(self):
+		self.original.cleanup()
+
+	# return: boolean
+	def is_opus(self):
+		return False
+
+
+class NoiseGate(object):
+	"""Silences the signal while it stays below a threshold
+
+	Opens within a couple of milliseconds when the level crosses the threshold, holds open for a while after it
+	drops back, then fades down to the floor over the release time.
+	"""
+	# str name
+	name = "gate"
+	# int attack_samples
+	# how quickly the gate opens
+	attack_samples = 96
+
+	# params: float threshold_db, float hold_ms, float release_ms, float floor_db
+	def __init__(self, threshold_db, hold_ms, release_ms, floor_db=-80.0):
+		# float threshold
+		# as a fraction of full scale
+		self.threshold = 10.0 ** (threshold_db / 20.0)
+		# int hold_frames
+		self.hold_frames = int(hold_ms / AdaptiveLatency.frame_ms)
+		# float release_step
+		# how far the gain falls per frame while closing
+		self.release_step = AdaptiveLatency.frame_ms / max(release_ms, AdaptiveLatency.frame_ms)
+		# float floor
+		self.floor = 10.0 ** (floor_db / 20.0)
+		# float gain
+		# where the last frame ended
+		self.gain = self.floor
+		# int held
+		# frames since the level was last above the threshold
+		self.held = self.hold_frames + 1
+		# np.ndarray attack
+		# ramp shape for opening: fast, then flat
+		self.attack = np.minimum(np.arange(1, DriftCompensator.frame_samples + 1, dtype=np.float32) / NoiseGate.attack_samples, 1.0)[:, None]
+		# np.ndarray steps
+		# ramp shape for closing: across the whole frame
+		self.steps = (np.arange(1, DriftCompensator.frame_samples + 1, dtype=np.float32) / DriftCompensator.frame_samples)[:, None]
+
+	# params: np.ndarray block
+	# return: np.ndarray
+	# block is float32 stereo, shaped (960, 2), full scale at 1.0
+	def process(self, block):
+		# float level
+		level = float(np.sqrt(np.mean(np.square(block))))
+		if level >= self.threshold:
+			self.held = 0
+		else:
+			self.held += 1
+
+		# float start
+		start = self.gain
+		if self.held <= self.hold_frames:
+			self.gain = 1.0
+			shape = self.attack
+		else:
+			self.gain = max(self.floor, self.gain - self.release_step)
+			shape = self.steps
+		if start == self.gain:
+			if start == 1.0:
+				return block
+			block *= np.float32(start)
+			return block
+		block *= np.float32(start) + np.float32(self.gain - start) * shape
+		return block
+
+
+class Compressor(object):
+	"""Turns the level down above a threshold by a fixed ratio
+
+	The level is measured once a frame and smoothed with separate attack and release times; the resulting gain is
+	ramped across each frame so it never steps.
+	"""
+	# str name
+	name = "compressor"
+
+	# params: float threshold_db, float ratio, float attack_ms, float release_ms, float makeup_db
+	def __init__(self, threshold_db, ratio, attack_ms, release_ms, makeup_db):
+		# float threshold_db
+		self.threshold_db = threshold_db
+		# float slope
+		# dB of gain reduction per dB over the threshold
+		self.slope = 1.0 - 1.0 / max(ratio, 1.0)
+		# float attack, release
+		# smoothing coefficients per frame
+		self.attack = 1.0 - np.exp(-AdaptiveLatency.frame_ms / max(attack_ms, 1.0))
+		self.release = 1.0 - np.exp(-AdaptiveLatency.frame_ms / max(release_ms, 1.0))
+		# float makeup
+		self.makeup = 10.0 ** (makeup_db / 20.0)
+		# float envelope_db
+		self.envelope_db = -120.0
+		# float gain
+		# where the last frame ended
+		self.gain = self.makeup
+		# np.ndarray steps
+		self.steps = (np.arange(1, DriftCompensator.frame_samples + 1, dtype=np.float32) / DriftCompensator.frame_samples)[:, None]
+
+	# params: np.ndarray block
+	# return: np.ndarray
+	def process(self, block):
+		# float level_db
+		# the frame's peak, so short transients still count
+		level_db = 20.0 * np.log10(max(float(np.max(np.abs(block))), 1e-6))
+		# float coefficient
+		coefficient = self.attack if level_db > self.envelope_db else self.release
+		self.envelope_db += (level_db - self.envelope_db) * coefficient
+		# float reduction_db
+		reduction_db = max(0.0, self.envelope_db - self.threshold_db) * self.slope
+		# float start
+		start = self.gain
+		self.gain = self.makeup * 10.0 ** (-reduction_db / 20.0)
+		if start == self.gain == 1.0:
+			return block
+		block *= np.float32(start) + np.float32(self.gain - start) * self.steps
+		return block
+
+
+class Limiter(object):
+	"""Brickwall limiter: nothing leaves above the ceiling
+
+	Pulls the gain down within a millisecond when a frame's peak would go over, lets it back up over the release time,
+	and clips whatever still slips past during the attack.
+	"""
+	# str name
+	name = "limiter"
+	# int attack_samples
+	attack_samples = 48
+
+	# params: float ceiling_db, float release_ms
+	def __init__(self, ceiling_db, release_ms):
+		# float ceiling
+		self.ceiling = 10.0 ** (ceiling_db / 20.0)
+		# float release_step
+		# how far the gain may rise per frame
+		self.release_step = AdaptiveLatency.frame_ms / max(release_ms, AdaptiveLatency.frame_ms)
+		# float gain
+		self.gain = 1.0
+		# np.ndarray attack, steps
+		self.attack = np.minimum(np.arange(1, DriftCompensator.frame_samples + 1, dtype=np.float32) / Limiter.attack_samples, 1.0)[:, None]
+		self.steps = (np.arange(1, DriftCompensator.frame_samples + 1, dtype=np.float32) / DriftCompensator.frame_samples)[:, None]
+		# int limited
+		# frames where we had to turn it down
+		self.limited = 0
+
+	# params: np.ndarray block
+	# return: np.ndarray
+	def process(self, block):
+		# float peak
+		peak = float(np.max(np.abs(block)))
+		# float needed
+		needed = min(1.0, self.ceiling / peak) if peak > 0.0 else 1.0
+		# float start
+		start = self.gain
+		if needed < start:
+			self.gain = needed
+			self.limited += 1
+			shape = self.attack
+		else:
+			self.gain = min(needed, start + self.release_step)
+			shape = self.steps
+		if start == self.gain == 1.0:
+			return block
+		if start != self.gain:
+			block *= np.float32(start) + np.float32(self.gain - start) * shape
+		else:
+			block *= np.float32(start)
+		np.clip(block, -self.ceiling, self.ceiling, out=block)
+		return block
+
+
+class DSPChain(discord.AudioSource):
+	"""Runs another AudioSource's frames through a list of processing stages
+
+	Each stage has process(block), taking and returning a float32 (960, 2) frame at full scale 1.0, and keeps whatever
+	state it needs between frames.  Time spent in each stage is recorded so we can see how much of the 20 ms we use.
+	"""
+	# int report_frames
+	# log the timing once a minute
+	report_frames = 3000
+
+	# params: discord.AudioSource original, List stages
+	def __init__(self, original, stages):
+		discord.AudioSource.__init__(self)
+		# discord.AudioSource original
+		self.original = original
+		# List stages
+		self.stages = stages
+		# List[float] stage_time
+		# seconds spent in each stage since the last report
+		self.stage_time = [0.0] * len(stages)
+		# List[float] stage_worst
+		self.stage_worst = [0.0] * len(stages)
+		# int frames
+		self.frames = 0
+
+	def read(self):
+		frame = self.original.read()
+		if not frame or len(frame) != VBANStream.bytes_per_frame:
+			return frame
+
+		# np.ndarray block
+		block = np.frombuffer(frame, dtype=np.int16).reshape(-1, 2).astype(np.float32)
+		block *= np.float32(1.0 / 32768.0)
+		for i, stage in enumerate(self.stages):
+			# float start
+			start = time.perf_counter()
+			block = stage.process(block)
+			# float elapsed
+			elapsed = time.perf_counter() - start
+			self.stage_time[i] += elapsed
+			if elapsed > self.stage_worst[i]:
+				self.stage_worst[i] = elapsed
+		block *= np.float32(32768.0)
+		np.rint(block, out=block)
+		np.clip(block, -32768, 32767, out=block)
+
+		self.frames += 1
+		if self.frames % DSPChain.report_frames == 0:
+			logging.info(self.report())
+		return block.astype(np.int16).tobytes()
+
+	# return: str
+	# average and worst time per frame for each stage since the last report; starts the next report afresh
+	def report(self):
+		# int frames
+		frames = self.frames % DSPChain.report_frames or DSPChain.report_frames
+		# List[str] parts
+		parts = ["{} {:.1f}/{:.1f} us".format(stage.name, self.stage_time[i] / frames * 1e6, self.stage_worst[i] * 1e6) for i, stage in enumerate(self.stages)]
+		self.stage_time = [0.0] * len(self.stages)
+		self.stage_worst = [0.0] * len(self.stages)
+		return "DSP average/worst per frame: " + ", ".join(parts)
+
+	# float volume
+	# passed through to the GainStage underneath the chain
+	@property
+	def volume(self):
+		return self.original.volume
+
+	@volume.setter
+	def volume(self, value):
+		self.original.volume = value
+
+	def cleanup(self):
+		self.original.cleanup()
+
+	# return: boolean
+	def is_opus(self):
+		return False
+
+# params: discord.AudioSource stream
+# return: discord.AudioSource
+# wraps stream in the DSP chain from the config file, or hands it back as it is if the chain is empty
+def make_dsp_chain(stream):
+	# List stages
+	stages = []
+	for name in config.get_config_list("DSP", "chain"):
+		name = name.strip()
+		if name == "gate":
+			stages.append(NoiseGate(
+				config.get_config_float("DSP", "gate_threshold_db"),
+				config.get_config_float("DSP", "gate_hold_ms"),
+				config.get_config_float("DSP", "gate_release_ms")))
+		elif name == "compressor":
+			stages.append(Compressor(
+				config.get_config_float("DSP", "compressor_threshold_db"),
+				config.get_config_float("DSP", "compressor_ratio"),
+				config.get_config_float("DSP", "compressor_attack_ms"),
+				config.get_config_float("DSP", "compressor_release_ms"),
+				config.get_config_float("DSP", "compressor_makeup_db")))
+		elif name == "limiter":
+			stages.append(Limiter(
+				config.get_config_float("DSP", "limiter_ceiling_db"),
+				config.get_config_float("DSP", "limiter_release_ms")))
+		elif name != "":
+			logging.error("Unknown DSP stage \"{}\"; leaving it out".format(name))
+	if len(stages) == 0:
+		return stream
+	logging.info("DSP chain: {}".format(" -> ".join(stage.name for stage in stages)))
+	return DSPChain(stream, stages)
+
+
+class MixerStream(discord.AudioSource):
+	"""Mixes several AudioSources down into one, with a gain for each
+
+	Every input is read once per frame and the whole mix is done in a single int32 accumulate with saturation back to
+	16-bit.  An input that has nothing to give (or falls short) is treated as silence for the rest of the frame.
+	"""
+	# int frame_values
+	# 16-bit values per Discord frame; 960 stereo samples
+	frame_values = 1920
+	# int gain_shift
+	# gains are applied as fixed point integers with this many fractional bits
+	gain_shift = 10
+	# float max_gain
+	max_gain = 2.0
+	# int max_inputs
+	# with gains of up to 2.0 in Q10, this many full-scale inputs still can't overflow the int32 accumulator
+	max_inputs = 32
+
+	def __init__(self):
+		discord.AudioSource.__init__(self)
+		# tuple mix
+		# (List[discord.AudioSource] sources, np.ndarray gains); replaced as a whole whenever an input changes,
+		# so the player thread always sees a consistent pair
+		self.mix = ([], np.zeros((0, 1), dtype=np.int32))
+		# np.ndarray block
+		# one row per input, reused from frame to frame
+		self.block = np.zeros((0, MixerStream.frame_values), dtype=np.int16)
+
+	# return: List[discord.AudioSource]
+	def inputs(self):
+		return list(self.mix[0])
+
+	# params: float gain
+	# return: int
+	def fixed_gain(self, gain):
+		return int(round(min(max(gain, 0.0), MixerStream.max_gain) * (1 << MixerStream.gain_shift)))
+
+	# params: discord.AudioSource source, float gain
+	# return: boolean
+	def add_input(self, source, gain=1.0):
+		sources, gains = self.mix
+		if len(sources) >= MixerStream.max_inputs:
+			logging.error("Mixer already has {} inputs; cannot add another".format(MixerStream.max_inputs))
+			return False
+		self.mix = (sources + [source], np.append(gains, [[self.fixed_gain(gain)]], axis=0).astype(np.int32))
+		return True
+
+	# params: discord.AudioSource source
+	# return: boolean
+	def remove_input(self, source):
+		sources, gains = self.mix
+		if source not in sources:
+			return False
+		# int index
+		index = sources.index(source)
+		self.mix = (sources[0:index] + sources[index + 1:], np.delete(gains, index, axis=0))
+		return True
+
+	# params: discord.AudioSource source, float gain
+	# return: boolean
+	def set_gain(self, source, gain):
+		sources, gains = self.mix
+		if source not in sources:
+			return False
+		gains = gains.copy()
+		gains[sources.index(source)] = self.fixed_gain(gain)
+		self.mix = (sources, gains)
+		return True
+
+	def read(self):
+		sources, gains = self.mix
+		# np.ndarray block
+		block = self.block
+		if len(block) != len(sources):
+			block = self.block = np.zeros((len(sources), MixerStream.frame_values), dtype=np.int16)
+
+		for i, source in enumerate(sources):
+			try:
+				data = source.read()
+			except Exception:
+				logging.exception("Mixer input {} failed; treating it as silence".format(i))
+				data = None
+			# int count
+			count = min(len(data) // 2, MixerStream.frame_values) if data else 0
+			if count > 0:
+				block[i, 0:count] = np.frombuffer(data, dtype=np.int16, count=count)
+			block[i, count:] = 0
+
+		# np.ndarray mixed
+		# products and their sum stay in int32; round, drop the fixed point fraction and saturate
+		mixed = (block * gains).sum(axis=0, dtype=np.int32)
+		mixed += 1 << (MixerStream.gain_shift - 1)
+		mixed >>= MixerStream.gain_shift
+		return np.clip(mixed, -32768, 32767).astype(np.int16).tobytes()
+
+	def cleanup(self):
+		for source in self.mix[0]:
+			source.cleanup()
+		self.mix = ([], np.zeros((0, 1), dtype=np.int32))
+
+	# return: boolean
+	def is_opus(self):
+		return False
+
+
+class OpusBroadcast(object):
+	"""Encodes one PCM AudioSource to Opus once per frame and hands the same packets to any number of voice clients
+
+	Each voice client plays its own OpusListener.  Whichever listener asks for a frame first reads and encodes it; the
+	rest get the packet that's already been made, so the cost stays the same however many channels are listening.
+	"""
+	# int history
+	# encoded frames kept for listeners whose player thread is running a little behind the others
+	history = 8
+	# bytes silence
+	# a complete Opus frame of silence, the same one discord.py sends when a player pauses
+	silence = b"\xf8\xff\xfe"
+
+	# params: discord.AudioSource source, discord.opus.Encoder encoder
+	def __init__(self, source, encoder=None):
+		# discord.AudioSource source
+		# must produce 20 ms of 48 kHz stereo PCM per read()
+		self.source = source
+		# discord.opus.Encoder encoder
+		self.encoder = encoder if encoder is not None else discord.opus.Encoder()
+		# threading.Lock lock
+		# every listener's player thread comes through here
+		self.lock = threading.Lock()
+		# List[bytes] packets
+		self.packets = [b""] * OpusBroadcast.history
+		# int newest
+		# sequence number of the newest encoded frame
+		self.newest = -1
+		# List[OpusListener] listeners
+		self.listeners = []
+		# int encoded
+		self.encoded = 0
+		# int skipped
+		# frames listeners missed because they fell more than history frames behind
+		self.skipped = 0
+
+	# return: OpusListener
+	def listen(self):
+		listener = OpusListener(self)
+		self.listeners.append(listener)
+		return listener
+
+	# params: OpusListener listener
+	def remove(self, listener):
+		if listener in self.listeners:
+			self.listeners.remove(listener)
+
+	# params: discord.AudioSource source
+	# swaps in a new source without disturbing the listeners
+	def set_source(self, source):
+		with self.lock:
+			old_source = self.source
+			self.source = source
+		if old_source is not None and old_source is not source:
+			old_source.cleanup()
+
+	# params: int sequence
+	# return: tuple(bytes, int)
+	# returns the packet for the requested frame and the sequence number it actually belongs to
+	def packet(self, sequence):
+		with self.lock:
+			if self.source is None:
+				# between sources; keep the listeners' players going with Opus silence
+				return OpusBroadcast.silence, self.newest
+			if sequence > self.newest:
+				# bytes pcm
+				pcm = self.source.read()
+				if not pcm:
+					# the source has ended; an empty read stops each listener's player, as it would without broadcasting
+					return b"", sequence
+				self.newest += 1
+				self.packets[self.newest % OpusBroadcast.history] = self.encoder.encode(pcm, self.encoder.SAMPLES_PER_FRAME)
+				self.encoded += 1
+				sequence = self.newest
+			elif sequence <= self.newest - OpusBroadcast.history:
+				# too far behind; catch up to the present rather than play stale audio
+				self.skipped += self.newest - sequence
+				sequence = self.newest
+			return self.packets[sequence % OpusBroadcast.history], sequence
+
+	def close(self):
+		self.set_source(None)
+		self.listeners = []
+
+
+class OpusListener(discord.AudioSource):
+	"""One voice client's view of an OpusBroadcast"""
+	# params: OpusBroadcast broadcast
+	def __init__(self, broadcast):
+		discord.AudioSource.__init__(self)
+		# OpusBroadcast broadcast
+		self.broadcast = broadcast
+		# int sequence
+		# the next frame to play; new listeners join at whatever gets encoded next
+		self.sequence = broadcast.newest + 1
+
+	def read(self):
+		packet, sequence = self.broadcast.packet(self.sequence)
+		self.sequence = sequence + 1
+		return packet
+
+	def cleanup(self):
+		# the player calls this when it stops; the broadcast and its source carry on for everyone else
+		self.broadcast.remove(self)
+
+	# return: boolean
+	def is_opus(self):
+		return True
 
 
 class PCMStream(discord.AudioSource):
+	"""Plays a local input device
+
+	PortAudio calls us back with each 20 ms block it captures and we drop it into a small FrameRing, so read() never
+	waits on the device; if a frame isn't ready yet, it plays silence instead of holding up the player thread.
+	"""
+	# int buffer_frames
+	# at most 100 ms of captured audio waits for the player; past that, new audio is dropped
+	buffer_frames = 5
+
 	def __init__(self):
 		discord.AudioSource.__init__(self)
 		self.stream = None
+		# FrameRing capture_buffer
+		# written by PortAudio's callback thread, read by the player thread
+		self.capture_buffer = FrameRing(PCMStream.buffer_frames, VBANStream.bytes_per_frame)
+		# int overruns
+		# blocks of captured audio we had to throw away, because the buffer was full or PortAudio itself overflowed
+		self.overruns = 0
+		# int underruns
+		# frames we played silence for because nothing had been captured yet
+		self.underruns = 0
+		# SilenceGate gate
+		# None if DTX is turned off
+		self.gate = make_silence_gate()
+
+	# params: buffer indata, int frames, CData time, sd.CallbackFlags status
+	# runs on PortAudio's thread; no logging or anything else that might block in here
+	def capture(self, indata, frames, time, status):
+		if status.input_overflow:
+			self.overruns += 1
+		if self.gate is not None and not self.gate.on_input(indata):
+			return
+		if self.capture_buffer.write(indata) < len(indata):
+			self.overruns += 1
 
 	def read(self):
 		if self.stream is None:
@@ -173,18 +1367,33 @@ class PCMStream(discord.AudioSource):
 			return
 		
 		# Discord reads 20 ms worth of audio at a time (20 ms * 50 == 1000 ms == 1 sec)
-		frames = int(self.stream.samplerate / 50)
-		data = self.stream.read(frames)[0]
-
-		# convert to pcm format
-		return bytes(data)
+		# int frame_len
+		frame_len = VBANStream.bytes_per_frame
+		# FrameRing capture_buffer
+		capture_buffer = self.capture_buffer
+		# bytes frame
+		frame = None
+		if len(capture_buffer) < frame_len:
+			# only count it once the device has started delivering; the first few reads always come up empty
+			if capture_buffer.write_count > 0:
+				self.underruns += 1
+			frame = bytes(frame_len)
+		else:
+			frame = capture_buffer.read(frame_len)
+		if self.gate is not None and self.gate.on_frame(frame):
+			# anything still queued is the tail end of the silence; don't make the next word wait behind it
+			capture_buffer.clear()
+		return frame
 
 	def change_device(self, num):
 		if self.stream is not None:
 			self.stream.stop()
 			self.stream.close()
 
-		self.stream = sd.RawInputStream(device=num)
+		# the old device's audio doesn't belong in front of the new one's
+		self.capture_buffer = FrameRing(PCMStream.buffer_frames, VBANStream.bytes_per_frame)
+		# one Discord frame per callback
+		self.stream = sd.RawInputStream(device=num, blocksize=int(sd.default.samplerate / 50), callback=self.capture)
 		self.stream.start()
 
 	def cleanup(self):
@@ -192,6 +1401,7 @@ class PCMStream(discord.AudioSource):
 			self.stream.stop()
 			self.stream.close()
 			self.stream = None
+			logging.info("Audio capture stopped; {} overruns, {} underruns".format(self.overruns, self.underruns))
 
 	def is_opus(self):
 		return False
@@ -3,107 +3,749 @@ import struct
 import sounddevice as sd
 import errno
 import logging
+import time
+import asyncio
+import threading
+import sys
+import numpy as np
+
+# struct.Struct VBAN_Header
+# the 28-byte VBAN header: magic, sample rate index + sub-protocol, samples - 1, channels - 1, data format,
+# stream name (null-padded) and frame counter
+VBAN_Header = struct.Struct("<4sBBBB16sL")
+# struct.Struct VBAN_FrameCounter
+# the header's last field on its own, at VBAN_FrameCounterOffset; everything before it stays the same for a stream
+VBAN_FrameCounter = struct.Struct("<L")
+VBAN_FrameCounterOffset = VBAN_Header.size - VBAN_FrameCounter.size
+
+# int VBAN_MaxPayload
+# the most audio the spec lets one packet carry, in bytes
+VBAN_MaxPayload = 1436
+# int VBAN_MaxSamples
+# the header holds samples per channel minus one in a single byte
+VBAN_MaxSamples = 256
+# float VBAN_LatencyChunk
+# seconds of audio per packet when the sender is tuned for latency rather than packet rate; 2.5 ms is an eighth of
+# a Discord frame, so the frames still come out of whole packets
+VBAN_LatencyChunk = 0.0025
+
+# int SO_TIMESTAMPNS
+# Linux's kernel receive timestamp option; Python's socket module doesn't export it
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+# struct.Struct VBAN_Timespec
+# struct timespec as the kernel hands it back in the ancillary data
+VBAN_Timespec = struct.Struct("@ll")
+
+# params: str streamName
+# return: bytes
+# the stream name exactly as it appears in the header, so names can be compared without decoding
+def packStreamName(streamName):
+	return streamName.encode('utf-8')[0:16].ljust(16, b"\x00")
+
+# int VBAN_SubProtocolRedundancy
+# redundancy packets go out under the VBAN user sub-protocol, which anything that doesn't know them ignores; the
+# rest of the header is the same as the audio packets', with the frame counter of the first packet covered
+VBAN_SubProtocolRedundancy = 0xE0
+# struct.Struct VBAN_RedundancyHeader
+# leads the payload of a redundancy packet: kind, packets covered, and how many packets after the first covered one
+# it was sent
+VBAN_RedundancyHeader = struct.Struct("<BBB")
+# int VBAN_RedundancyDuplicate, VBAN_RedundancyParity
+# a copy of one earlier packet's audio, or the XOR of a group of them
+VBAN_RedundancyDuplicate = 1
+VBAN_RedundancyParity = 2
+
+# params: int channels, int sampleWidth, int mtu, boolean ipv6, int reserve
+# return: int
+# the most samples per channel that keep a packet within the VBAN limits and within one IP packet on a link with
+# this MTU, so it's never fragmented; reserve is bytes of payload kept back for something other than audio
+def largestChunkSize(channels, sampleWidth, mtu=1500, ipv6=True, reserve=0):
+	# int payload
+	# what's left of the MTU after the IP, UDP and VBAN headers
+	payload = min(VBAN_MaxPayload, mtu - (40 if ipv6 else 20) - 8 - VBAN_Header.size) - reserve
+	return max(1, min(VBAN_MaxSamples, payload // (channels * sampleWidth)))
+
+# params: int sampRate
+# return: int
+def latencyChunkSize(sampRate):
+	return max(1, min(VBAN_MaxSamples, int(round(sampRate * VBAN_LatencyChunk))))
+
+# params: int counter, int reference
+# return: int
+# signed distance from reference to counter, accounting for the 32-bit frame counter wrapping around
+def _counterDiff(counter, reference):
+	return ((counter - reference + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+class VBAN_JitterBuffer(object):
+	"""Puts VBAN packets back in frame counter order and reports the ones that never showed up
+
+	If the sender sends redundancy packets, a packet that never showed up is rebuilt from them where it can be before
+	it's given up on.
+	"""
+	# int resync_gap
+	# a jump of more than this many packets in either direction means the sender restarted
+	resync_gap = 1000
+	# int redundancy_span
+	# the furthest back a redundancy packet may reach; also how many played packets we keep for rebuilding from
+	# parity
+	redundancy_span = 32
+
+	def __init__(self, window):
+		super(VBAN_JitterBuffer, self).__init__()
+		# int window
+		# how many packets past a gap we wait for the missing packet before giving up on it
+		self.window = window
+		# dict[int, bytes] pending
+		# packets received ahead of a gap, keyed by frame counter
+		self.pending = {}
+		# int next_counter
+		# frame counter of the next packet to release; None until the first packet arrives
+		self.next_counter = None
+		# int newest
+		# distance from next_counter to the newest pending packet
+		self.newest = -1
+		# int lost
+		self.lost = 0
+		# int dropped
+		# late or duplicate packets that were discarded
+		self.dropped = 0
+		# float jitter
+		# smoothed packet inter-arrival jitter in seconds, as in RFC 3550
+		self.jitter = 0.0
+		# int last_counter
+		self.last_counter = None
+		# float last_arrival
+		self.last_arrival = 0.0
+		# int redundancy_wait
+		# how many packets past a gap the redundancy that covers it can turn up; 0 until some redundancy arrives
+		self.redundancy_wait = 0
+		# dict[int, bytes] duplicates
+		# copies of packets we haven't played yet, keyed by frame counter
+		self.duplicates = {}
+		# dict[int, tuple] parity
+		# (packets covered, XOR of their payloads), keyed by the frame counter of the first
+		self.parity = {}
+		# dict[int, bytes] played
+		# the last redundancy_span payloads played, for rebuilding from parity; only kept once redundancy turns up
+		self.played = {}
+		# int recovered
+		# lost packets rebuilt from redundancy
+		self.recovered = 0
+
+	def reset(self):
+		self.pending.clear()
+		self.next_counter = None
+		self.newest = -1
+		self.duplicates.clear()
+		self.parity.clear()
+		self.played.clear()
+
+	# params: int counter, float arrival, float duration
+	def _measure(self, counter, arrival, duration):
+		if self.last_counter is not None:
+			# int steps
+			steps = _counterDiff(counter, self.last_counter)
+			if -VBAN_JitterBuffer.resync_gap <= steps <= VBAN_JitterBuffer.resync_gap:
+				# float deviation
+				# how far the arrival spacing strayed from the spacing the sender intended
+				deviation = (arrival - self.last_arrival) - steps * duration
+				self.jitter += (abs(deviation) - self.jitter) / 16.0
+		self.last_counter = counter
+		self.last_arrival = arrival
+
+	# params: int counter, bytes-like payload, float arrival, float duration
+	# return: List[bytes-like]
+	# returns the payloads that are now ready to play, in order; None stands in for each lost packet
+	# arrival is when the packet was received and duration how much audio it carries, both in seconds
+	# an in-order payload comes straight back out, so it may be a view into a reused receive buffer; anything held
+	# back for reordering is copied first
+	def push(self, counter, payload, arrival=None, duration=0.0):
+		# List[bytes] released
+		released = []
+		if arrival is not None:
+			self._measure(counter, arrival, duration)
+		if self.next_counter is None:
+			self.next_counter = counter
+
+		# int diff
+		diff = _counterDiff(counter, self.next_counter)
+		if diff > VBAN_JitterBuffer.resync_gap or diff < -VBAN_JitterBuffer.resync_gap:
+			# sender restarted or we were away for a long time; play what we have and start over from here
+			logging.info("VBAN frame counter jumped from {} to {}; resynchronizing".format(self.next_counter, counter))
+			for key in sorted(self.pending, key=lambda c: _counterDiff(c, self.next_counter)):
+				released.append(self.pending[key])
+			self.reset()
+			self.next_counter = counter
+			diff = 0
+		elif diff < 0 or counter in self.pending:
+			# already played (or given up on) this one, or we have it already
+			self.dropped += 1
+			return released
+		elif diff == 0 and not self.pending:
+			# the usual case: exactly the packet we were waiting for, with nothing queued behind it
+			if self.redundancy_wait:
+				self._remember(counter, bytes(payload))
+			self.next_counter = (self.next_counter + 1) & 0xFFFFFFFF
+			released.append(payload)
+			return released
+
+		self.pending[counter] = bytes(payload)
+		self.newest = max(self.newest, diff)
+		self._release(released)
+		return released
+
+	# params: List[bytes-like] released
+	# moves everything that's ready from pending onto released
+	def _release(self, released):
+		# int window
+		# with redundancy coming, a gap is worth waiting on until it's had the chance to arrive
+		window = max(self.window, self.redundancy_wait + 1) if self.redundancy_wait else self.window
+		while self.pending:
+			# bytes payload
+			payload = self.pending.pop(self.next_counter, None)
+			if payload is None and self.redundancy_wait:
+				payload = self._rebuild(self.next_counter)
+				if payload is not None:
+					self.recovered += 1
+			if payload is not None:
+				released.append(payload)
+				if self.redundancy_wait:
+					self._remember(self.next_counter, payload)
+			elif self.newest >= window:
+				# waited long enough; conceal this one and move on
+				released.append(None)
+				self.lost += 1
+			else:
+				break
+			self.next_counter = (self.next_counter + 1) & 0xFFFFFFFF
+			self.newest -= 1
+		if not self.pending:
+			self.newest = -1
+
+	# params: int counter, bytes payload
+	def _remember(self, counter, payload):
+		self.played[counter] = payload
+		self.played.pop((counter - VBAN_JitterBuffer.redundancy_span) & 0xFFFFFFFF, None)
+		# redundancy for packets this far back is no use to us any more
+		self.duplicates.pop(counter, None)
+		self.parity.pop((counter - VBAN_JitterBuffer.redundancy_span) & 0xFFFFFFFF, None)
+
+	# params: int counter
+	# return: bytes
+	# the missing packet counter put back together from redundancy, or None if that can't be done (yet)
+	def _rebuild(self, counter):
+		# bytes payload
+		payload = self.duplicates.pop(counter, None)
+		if payload is not None:
+			return payload
+		for first, (count, xor) in self.parity.items():
+			# int offset
+			offset = _counterDiff(counter, first)
+			if offset < 0 or offset >= count:
+				continue
+			# List[bytes] others
+			# every other packet in the group, from those already played and those waiting behind the gap
+			others = []
+			for member in range(count):
+				if member != offset:
+					key = (first + member) & 0xFFFFFFFF
+					other = self.pending.get(key, self.played.get(key))
+					if other is None or len(other) != len(xor):
+						break
+					others.append(other)
+			else:
+				rebuilt = np.frombuffer(xor, dtype=np.uint8).copy()
+				for other in others:
+					np.bitwise_xor(rebuilt, np.frombuffer(other, dtype=np.uint8), out=rebuilt)
+				return rebuilt.tobytes()
+		return None
+
+	# params: int counter, int kind, int count, int delay, bytes-like payload
+	# return: List[bytes-like]
+	# takes a redundancy packet covering count packets from counter onwards, sent delay packets after the first of
+	# them; like push(), returns whatever that lets us play
+	def pushRedundancy(self, counter, kind, count, delay, payload):
+		# List[bytes] released
+		released = []
+		if self.next_counter is None or count == 0 or count > VBAN_JitterBuffer.redundancy_span or delay >= VBAN_JitterBuffer.redundancy_span:
+			return released
+		# learn how long redundancy takes to arrive even from packets that come too late to be any use; a duplicate
+		# always turns up after the packet it copies would have been given up on if we didn't
+		self.redundancy_wait = max(self.redundancy_wait, delay)
+		if _counterDiff((counter + count - 1) & 0xFFFFFFFF, self.next_counter) < 0:
+			# covers nothing we're still waiting on
+			return released
+		if kind == VBAN_RedundancyDuplicate:
+			if _counterDiff(counter, self.next_counter) >= 0 and counter not in self.pending:
+				self.duplicates[counter] = bytes(payload)
+		elif kind == VBAN_RedundancyParity:
+			self.parity[counter] = (count, bytes(payload))
+		else:
+			return released
+		# the gap at the front may be fillable now, with no need to wait out the window
+		self._release(released)
+		return released
+
+class VBAN_FIRFilter(object):
+	"""Windowed-sinc low-pass filter over stereo blocks that carries its history from one block to the next"""
+	# int taps
+	taps = 48
+
+	# params: float cutoff
+	# cutoff is a fraction of the sample rate the filter runs at (0.5 being Nyquist)
+	def __init__(self, cutoff):
+		super(VBAN_FIRFilter, self).__init__()
+		n = np.arange(VBAN_FIRFilter.taps) - (VBAN_FIRFilter.taps - 1) / 2.0
+		kernel = 2.0 * cutoff * np.sinc(2.0 * cutoff * n) * np.hanning(VBAN_FIRFilter.taps)
+		self.kernel = (kernel / kernel.sum()).astype(np.float32)
+		self.history = np.zeros((VBAN_FIRFilter.taps - 1, 2), dtype=np.float32)
+
+	# params: np.ndarray block
+	# return: np.ndarray
+	def process(self, block):
+		extended = np.concatenate((self.history, block))
+		self.history = extended[len(extended) - (VBAN_FIRFilter.taps - 1):]
+		out = np.empty_like(block)
+		for channel in range(2):
+			out[:, channel] = np.convolve(extended[:, channel], self.kernel, mode="valid")
+		return out
+
+# VBAN data type nibble (low three bits of the format byte) -> (numpy dtype, scale to 16-bit range)
+# 24-bit samples have no numpy dtype of their own and are unpacked by hand into the top of an int32
+VBAN_DataTypes = {
+	0: (np.dtype("u1"), 256.0),			# VBAN_DATATYPE_BYTE8
+	1: (np.dtype("<i2"), 1.0),			# VBAN_DATATYPE_INT16
+	2: (None, 1.0 / 65536.0),			# VBAN_DATATYPE_INT24
+	3: (np.dtype("<i4"), 1.0 / 65536.0),	# VBAN_DATATYPE_INT32
+	4: (np.dtype("<f4"), 32767.0),		# VBAN_DATATYPE_FLOAT32
+	5: (np.dtype("<f8"), 32767.0),		# VBAN_DATATYPE_FLOAT64
+}
+
+# params: int dataFormat
+# return: boolean
+def isSupportedFormat(dataFormat):
+	# the high nibble is the codec, which has to be plain PCM
+	return (dataFormat & 0xF0) == 0 and (dataFormat & 0x07) in VBAN_DataTypes
+
+# params: int dataFormat
+# return: int
+# bytes per sample
+def sampleWidth(dataFormat):
+	dataType = VBAN_DataTypes[dataFormat & 0x07][0]
+	return 3 if dataType is None else dataType.itemsize
+
+class VBAN_Converter(object):
+	"""Converts incoming VBAN audio of any supported format, sample rate and channel count to 48 kHz 16-bit stereo
+
+	Works a whole packet at a time.  Samples are read straight out of the packet through numpy.frombuffer and
+	carried as float until the end, where they are dithered (if they had more than 16 bits of resolution), rounded
+	and clipped to 16 bits in a single pass.  The resampler interpolates linearly between input samples, with a
+	low-pass filter in front of it when downsampling and behind it when upsampling to keep aliases and images out of
+	the audible band.  Filter history and the fractional read position carry across packets, so packet boundaries
+	don't click.
+	"""
+	# np.ndarray dither
+	# triangular (TPDF) dither of +/- 1 LSB, generated once and cycled through
+	dither = (np.random.default_rng(0).random(65536) - np.random.default_rng(1).random(65536)).astype(np.float32)
+
+	# params: int inRate, int inChannels, int dataFormat, int outRate
+	def __init__(self, inRate, inChannels, dataFormat=1, outRate=48000):
+		super(VBAN_Converter, self).__init__()
+		self.inRate = inRate
+		self.inChannels = inChannels
+		self.dataFormat = dataFormat
+		self.outRate = outRate
+		self.dataType, self.scale = VBAN_DataTypes[dataFormat & 0x07]
+		# bool dithered
+		# only formats finer than 16 bits need dithering on the way down
+		self.dithered = (dataFormat & 0x07) not in (0, 1)
+		self.ditherPos = 0
+		# float step
+		# input samples per output sample
+		self.step = inRate / outRate
+		# float phase
+		# input position of the next output sample, counted from the last sample of the previous packet
+		self.phase = 1.0
+		self.last = np.zeros(2, dtype=np.float32)
+		self.preFilter = VBAN_FIRFilter(0.45 / self.step) if inRate > outRate else None
+		self.postFilter = VBAN_FIRFilter(0.45 * self.step) if inRate < outRate else None
+
+	# return: boolean
+	def is_passthrough(self):
+		return self.inRate == self.outRate and self.inChannels == 2 and (self.dataFormat & 0x07) == 1
+
+	# params: bytes-like pcm
+	# return: np.ndarray
+	# float samples on a 16-bit scale, still interleaved
+	def _decode(self, pcm):
+		if self.dataType is None:
+			# 24-bit: shift each little-endian triple into the top of an int32 so the sign comes along for free
+			raw = np.frombuffer(pcm, dtype=np.uint8)
+			raw = raw[0:len(raw) - len(raw) % 3].reshape(-1, 3).astype(np.int32)
+			samples = (raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)
+			return samples.astype(np.float32) * self.scale
+		samples = np.frombuffer(pcm, dtype=self.dataType, count=len(pcm) // self.dataType.itemsize)
+		if self.dataType.kind == "u":
+			return (samples.astype(np.float32) - 128.0) * self.scale
+		return samples.astype(np.float32) * self.scale
+
+	# params: np.ndarray samples
+	# return: np.ndarray
+	# folds interleaved samples of any channel count down (or up) to stereo
+	def _toStereo(self, samples):
+		frames = samples[0:len(samples) - len(samples) % self.inChannels].reshape(-1, self.inChannels)
+		if self.inChannels == 1:
+			return np.repeat(frames, 2, axis=1)
+		elif self.inChannels == 2:
+			return frames
+		# even channels to the left, odd channels to the right
+		return np.stack((frames[:, 0::2].mean(axis=1), frames[:, 1::2].mean(axis=1)), axis=1)
+
+	# params: np.ndarray block
+	# return: np.ndarray
+	def _resample(self, block):
+		count = len(block)
+		extended = np.empty((count + 1, 2), dtype=np.float32)
+		extended[0] = self.last
+		extended[1:] = block
+		# int outCount
+		# how many output samples land on or before the last input sample
+		outCount = int(np.floor((count - self.phase) / self.step + 1e-9)) + 1 if self.phase <= count else 0
+		pos = self.phase + np.arange(outCount) * self.step
+		left = np.minimum(pos.astype(np.intp), count)
+		right = np.minimum(left + 1, count)
+		frac = (pos - left).astype(np.float32)[:, None]
+		self.phase = self.phase + outCount * self.step - count
+		self.last = extended[count].copy()
+		return extended[left] + (extended[right] - extended[left]) * frac
+
+	# params: np.ndarray block
+	# return: bytes
+	def _toInt16(self, block):
+		out = block.reshape(-1)
+		if self.dithered:
+			count = len(out)
+			if self.ditherPos + count > len(VBAN_Converter.dither):
+				self.ditherPos = 0
+			out = out + VBAN_Converter.dither[self.ditherPos:self.ditherPos + count]
+			self.ditherPos += count
+		return np.clip(np.rint(out), -32768, 32767).astype(np.int16).tobytes()
+
+	# params: bytes-like pcm
+	# return: bytes
+	def convert(self, pcm):
+		if self.is_passthrough():
+			return pcm
+		block = self._toStereo(self._decode(pcm))
+		if self.inRate != self.outRate:
+			if self.preFilter is not None:
+				block = self.preFilter.process(block)
+			block = self._resample(block)
+			if self.postFilter is not None:
+				block = self.postFilter.process(block)
+		return self._toInt16(block)
+
+class VBAN_PacketPool(object):
+	"""Preallocated receive buffers, so that taking in a packet never allocates"""
+	# int slot_size
+	# VBAN packets top out at 1436 bytes; leave room for anything oversized to be truncated rather than overrun
+	slot_size = 2048
+
+	# params: int size
+	def __init__(self, size):
+		super(VBAN_PacketPool, self).__init__()
+		self.buffer = bytearray(size * VBAN_PacketPool.slot_size)
+		view = memoryview(self.buffer)
+		# List[memoryview] slots
+		self.slots = [view[i * VBAN_PacketPool.slot_size:(i + 1) * VBAN_PacketPool.slot_size] for i in range(size)]
+		# List[tuple] batch
+		# (byte count, sender address, arrival time) for each slot filled by VBAN_Recv.runbatch()
+		self.batch = [None] * size
+		self.index = 0
+
+	# return: memoryview
+	# hands out slots round-robin; a slot stays valid until the pool comes back around to it
+	def next(self):
+		slot = self.slots[self.index]
+		self.index = (self.index + 1) % len(self.slots)
+		return slot
+
+class VBAN_RecvProtocol(asyncio.DatagramProtocol):
+	"""Hands datagrams to a VBAN_Recv the moment the event loop sees them"""
+	def __init__(self, receiver):
+		super(VBAN_RecvProtocol, self).__init__()
+		self.receiver = receiver
+
+	def datagram_received(self, data, addr):
+		try:
+			self.receiver.handlePacket(data, addr, time.monotonic())
+		except Exception:
+			logging.exception("Error handling VBAN packet from {}".format(addr[0]))
+
+	def error_received(self, exc):
+		logging.warning("VBAN socket error: {}".format(exc))
+
+class VBAN_RecvRoute(object):
+	"""Everything VBAN_Recv keeps for one incoming stream: reordering, format conversion and where the audio goes"""
+	# int conceal_packets
+	# how many lost packets in a row we fade the last good packet across before going silent
+	conceal_packets = 4
+
+	# params: str senderIp, bytes streamNameBytes, stream, int reorderWindow
+	# senderIp is None to accept the stream from anyone
+	# stream is anything with write(bytes) and close(), e.g. sound.VBANStream or a sounddevice output stream
+	def __init__(self, senderIp, streamNameBytes, stream, reorderWindow):
+		super(VBAN_RecvRoute, self).__init__()
+		self.senderIp = senderIp
+		self.streamNameBytes = streamNameBytes
+		# tuple streams
+		# everything this stream's audio is written to; replaced rather than changed in place, since the receiver
+		# thread may be partway through writing to it
+		self.streams = (stream,)
+		self.jitterBuffer = VBAN_JitterBuffer(reorderWindow)
+		self.converter = None
+		self.lastPcm = None
+		self.lastBuffer = bytearray(2048)
+		self.concealRun = 0
+		self.badFormat = None
+		self.packets = 0
+		# int redundancyPackets
+		self.redundancyPackets = 0
+		# int bytes, redundancyBytes
+		# payload received as audio and as redundancy, for working out what redundancy costs
+		self.bytes = 0
+		self.redundancyBytes = 0
+
+	# return: tuple
+	def key(self):
+		return (self.senderIp, self.streamNameBytes)
+
+	# params: VBAN_Recv receiver
+	def _correctConverter(self, receiver):
+		# the output stays 48 kHz stereo; we convert whatever the sender gives us to match
+		logging.info("VBAN stream is {} Hz with {} channel(s) in format {:#04x}; converting to {} Hz 16-bit stereo".format(receiver.stream_sampRate, receiver.stream_chanNum, receiver.stream_dataFormat, receiver.sampRate))
+		self.converter = VBAN_Converter(receiver.stream_sampRate, receiver.stream_chanNum, receiver.stream_dataFormat, receiver.sampRate)
+		# anything still waiting to be reordered is in the old format
+		self.jitterBuffer.reset()
+
+	# params: bytes-like pcm
+	def _keepLastPcm(self, pcm):
+		# pcm may point into the receive pool, which is about to be reused, so copy it somewhere that isn't
+		if len(self.lastBuffer) < len(pcm):
+			self.lastBuffer = bytearray(len(pcm))
+		self.lastBuffer[0:len(pcm)] = pcm
+		self.lastPcm = memoryview(self.lastBuffer)[0:len(pcm)]
+
+	# params: int channels
+	def _concealPcm(self, channels):
+		# fade the last good packet out over a few packets, then fall silent
+		self.concealRun += 1
+		if self.lastPcm is None or self.concealRun > VBAN_RecvRoute.conceal_packets:
+			return bytes(len(self.lastPcm) if self.lastPcm is not None else 0)
+		samples = np.frombuffer(self.lastPcm, dtype=np.int16)
+		frames = len(samples) // channels
+		start = 1.0 - (self.concealRun - 1) / VBAN_RecvRoute.conceal_packets
+		end = 1.0 - self.concealRun / VBAN_RecvRoute.conceal_packets
+		ramp = np.repeat(np.linspace(start, end, frames, endpoint=False, dtype=np.float32), channels)
+		return (samples[0:len(ramp)] * ramp).astype(np.int16).tobytes()
+
+	# params: VBAN_Recv receiver, bytes-like payload, float arrival
+	# the header fields come from the receiver, which has just parsed them
+	def handlePayload(self, receiver, payload, arrival):
+		streams = self.streams
+		if len(streams) == 0:
+			return
+		self.packets += 1
+		if not isSupportedFormat(receiver.stream_dataFormat):
+			if self.badFormat != receiver.stream_dataFormat:
+				logging.warning("Ignoring VBAN stream with unsupported data format {:#04x}".format(receiver.stream_dataFormat))
+				self.badFormat = receiver.stream_dataFormat
+			return
+		if self.converter is None or self.converter.inChannels != receiver.stream_chanNum or self.converter.inRate != receiver.stream_sampRate or self.converter.dataFormat != receiver.stream_dataFormat:
+			self._correctConverter(receiver)
+		duration = receiver.stream_sampNum / receiver.stream_sampRate
+		payload = self._trimPayload(receiver, payload)
+		self.bytes += len(payload)
+		self._play(receiver, streams, self.jitterBuffer.push(receiver.stream_frameCounter, payload, arrival, duration))
+
+	# params: VBAN_Recv receiver, bytes-like data
+	# like handlePayload(), but for a redundancy packet; data is everything after the VBAN header
+	def handleRedundancy(self, receiver, data):
+		streams = self.streams
+		if len(streams) == 0 or len(data) < VBAN_RedundancyHeader.size:
+			return
+		if self.converter is None or self.converter.inChannels != receiver.stream_chanNum or self.converter.inRate != receiver.stream_sampRate or self.converter.dataFormat != receiver.stream_dataFormat:
+			# it's rebuilt into audio of the same format as the packets around it, and we haven't seen any of those
+			return
+		kind, count, delay = VBAN_RedundancyHeader.unpack_from(data)
+		payload = self._trimPayload(receiver, data[VBAN_RedundancyHeader.size:])
+		self.redundancyPackets += 1
+		self.redundancyBytes += len(payload)
+		self._play(receiver, streams, self.jitterBuffer.pushRedundancy(receiver.stream_frameCounter, kind, count, delay, payload))
+
+	# params: VBAN_Recv receiver, bytes-like payload
+	# return: bytes-like
+	def _trimPayload(self, receiver, payload):
+		# senders pick their own packet size, and nothing downstream cares how it lines up with Discord's frames, but
+		# it does need whole samples on every channel; anything past the sample count the header gives is padding
+		frameBytes = receiver.stream_chanNum * sampleWidth(receiver.stream_dataFormat)
+		return payload[0:min(len(payload), receiver.stream_sampNum * frameBytes) // frameBytes * frameBytes]
+
+	# return: str
+	# None until any redundancy has arrived
+	def redundancyStats(self):
+		if self.redundancyPackets == 0:
+			return None
+		# int missing
+		missing = self.jitterBuffer.recovered + self.jitterBuffer.lost
+		return "redundancy added {:.0f}% to the data received and rebuilt {} of {} missing packets ({:.0f}%)".format(
+			100.0 * self.redundancyBytes / max(1, self.bytes), self.jitterBuffer.recovered, missing, 100.0 * self.jitterBuffer.recovered / max(1, missing))
+
+	# params: VBAN_Recv receiver, tuple streams, List[bytes-like] released
+	def _play(self, receiver, streams, released):
+		for pcm in released:
+			if pcm is None:
+				pcm = self._concealPcm(receiver.channels)
+				if receiver.verbose:
+					logging.debug("Concealing lost VBAN packet")
+			else:
+				pcm = self.converter.convert(pcm)
+				self._keepLastPcm(pcm)
+				self.concealRun = 0
+			for stream in streams:
+				stream.write(pcm)
 
 class VBAN_Recv(object):
-	"""docstring for VBAN_Recv"""
-	def __init__(self, senderHost, streamName, port, outDeviceIndex, ipv6=True, verbose=False, stream=None):
+	"""Receives VBAN audio on one port and hands each stream to its own route
+
+	Packets are matched to routes by sender address and stream name with a dict lookup, so one socket can serve any
+	number of senders and streams.  A route with no sender address takes its stream name from anyone.
+	"""
+	# params: str senderHost, str streamName, int port, int outDeviceIndex, ...
+	# senderHost and streamName set up an initial route to stream (or to a new sounddevice output if stream is None);
+	# pass streamName=None to start with no routes and add them with addRoute()
+	def __init__(self, senderHost, streamName, port, outDeviceIndex, ipv6=True, verbose=False, stream=None, reorderWindow=4, poolSize=16, rcvBuf=0):
 		super(VBAN_Recv, self).__init__()
-		self.streamName = streamName
 		self.const_VBAN_SRList = [6000, 12000, 24000, 48000, 96000, 192000, 384000, 8000, 16000, 32000, 64000, 128000, 256000, 512000, 11025, 22050, 44100, 88200, 176400, 352800, 705600] 
-		family = socket.AF_INET6 if ipv6 else socket.AF_INET
-		self.any_sender = senderHost is None
-		for addrInfoTuple in socket.getaddrinfo(senderHost, port, family=family, type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP):
-			# Break up the tuple
-			famInfo, typeInfo, protoInfo, canonName, socketAddr = addrInfoTuple
-			if self.any_sender:
-				# socket.getaddrinfo() gives localhost for the ip address if the host is None, but
-				# that's not what socket.bind() wants
-				# stupid tuples and immutability...
-				socketAddr = socketAddr[:0] + ("::" if ipv6 else "0.0.0.0",) + socketAddr[1:]
-			self.senderIp = socketAddr[0]	# The first element of the sockAddr tuple is the IP address under both IPv4 and IPv6
-			try:
-				self.sock = socket.socket(family, socket.SOCK_DGRAM) # UDP
-				self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-				#self.sock.setsockopt(socket.SOL_IP, 15, 1) # optname 15 refers to IP_FREEBIND
-				self.sock.bind(socketAddr)
-			except Exception:
-				printed_ip = self.senderIp
-				if self.any_sender:
-					printed_ip = "[::/0]" if ipv6 else "0.0.0.0/0"
-				elif ipv6:
-					printed_ip = "[" + printed_ip + "]"
-				logging.exception("Failed socket binding for {}:{}.".format(printed_ip, port))
-				self.sock = None
-				continue
-			break
-		if self.sock is None:
+		self.family = socket.AF_INET6 if ipv6 else socket.AF_INET
+		self.port = port
+		self.ipv6 = ipv6
+		# we listen on every address; routes decide whose packets we keep
+		# str bindIp
+		bindIp = "::" if ipv6 else "0.0.0.0"
+		try:
+			self.sock = socket.socket(self.family, socket.SOCK_DGRAM) # UDP
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			#self.sock.setsockopt(socket.SOL_IP, 15, 1) # optname 15 refers to IP_FREEBIND
+			self.sock.bind((bindIp, port))
+		except Exception:
+			logging.exception("Failed socket binding for {}:{}.".format("[::/0]" if ipv6 else "0.0.0.0/0", port))
 			raise RuntimeError("Could not initialize VBAN recv socket!")
 
 		self.sock.setblocking(False)
+		if rcvBuf > 0:
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvBuf)
+			logging.info("VBAN socket receive buffer is {} bytes".format(self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
 		self.sampRate = 48000
 		self.channels = 2
 		self.outDeviceIndex=outDeviceIndex
-		self.stream_magicString = ""
+		self.stream_magicString = b""
 		self.stream_sampRate = 0
 		self.stream_sampNum = 0
 		self.stream_chanNum = 0
 		self.stream_dataFormat = 0
-		self.stream_streamName = ""
+		self.stream_streamName = b""
 		self.stream_frameCounter = 0
-		if stream is None:
-			self.stream = sd.RawOutputStream(device=self.outDeviceIndex)
-			self.stream.start()
-		else:
-			self.stream = stream
 		self.rawPcm = None
 		self.running = True
 		self.verbose = verbose
 		self.rawData = None
 		self.subprotocol = 0
+		self.reorderWindow = reorderWindow
+		# dict[tuple, VBAN_RecvRoute] routes
+		# keyed by (sender IP or None, stream name as raw header bytes)
+		self.routes = {}
+		# VBAN_PacketPool pool
+		self.pool = VBAN_PacketPool(poolSize)
+		self.transport = None
+		self.readerLoop = None
+		self.thread = None
+		self.kernelTimestamps = False
+		if streamName is not None:
+			if stream is None:
+				stream = sd.RawOutputStream(device=self.outDeviceIndex)
+				stream.start()
+			self.addRoute(senderHost, streamName, stream)
 		logging.info("pyVBAN-Recv Started")
-		logging.info("Hint: Remeber that pyVBAN only support's PCM 16bits")
 
-	def _correctPyAudioStream(self):
-		self.channels = self.stream_chanNum 
-		self.sampRate = self.stream_sampRate
-		self.stream.stop()
-		self.stream = sd.RawOutputStream(device=self.outDeviceIndex)
-		self.stream.start()
+	# params: str senderHost, str streamName, stream
+	# return: VBAN_RecvRoute
+	def addRoute(self, senderHost, streamName, stream):
+		senderIp = None
+		if senderHost is not None:
+			# The first element of the sockAddr tuple is the IP address under both IPv4 and IPv6
+			# on an IPv6 socket, IPv4 senders show up as v4-mapped addresses, so look them up that way
+			flags = getattr(socket, "AI_V4MAPPED", 0) if self.ipv6 else 0
+			senderIp = socket.getaddrinfo(senderHost, self.port, family=self.family, type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP, flags=flags)[0][4][0]
+		route = VBAN_RecvRoute(senderIp, packStreamName(streamName), stream, self.reorderWindow)
+		existing = self.routes.get(route.key())
+		if existing is not None:
+			# someone is already receiving this stream; decode it once and write it to both
+			existing.streams = existing.streams + (stream,)
+			return existing
+		self.routes[route.key()] = route
+		return route
+
+	# params: VBAN_RecvRoute route, stream
+	# detaches stream from the route, or every stream if it's None; the route goes once nothing is left on it
+	def removeRoute(self, route, stream=None):
+		route.streams = tuple(s for s in route.streams if stream is not None and s is not stream)
+		if len(route.streams) == 0 and self.routes.get(route.key()) is route:
+			del self.routes[route.key()]
 
 	def _cutAtNullByte(self,stri):
-		return stri.decode('utf-8').split("\x00")[0]
+		return stri.decode('utf-8', 'replace').split("\x00")[0]
 
 	def _parseHeader(self,data):
-		self.stream_magicString = data[0:4].decode('utf-8')
-		sampRateIndex = data[4] & 0x1F
-		self.subprotocol = (data[4] & 0xE0) >> 5
-		self.stream_sampRate = self.const_VBAN_SRList[sampRateIndex]
-		self.stream_sampNum = data[5] + 1
-		self.stream_chanNum = data[6] + 1
-		self.stream_dataFormat = data[7]
-		self.stream_streamName = self._cutAtNullByte(b''.join(struct.unpack("cccccccccccccccc",data[8:24])))
-		self.stream_frameCounter = struct.unpack("<L",data[24:28])[0]
+		# the stream name stays as raw bytes, which is how routes are keyed
+		self.stream_magicString, sampRateByte, sampNum, chanNum, self.stream_dataFormat, self.stream_streamName, self.stream_frameCounter = VBAN_Header.unpack_from(data)
+		self.subprotocol = (sampRateByte & 0xE0) >> 5
+		self.stream_sampRate = self.const_VBAN_SRList[sampRateByte & 0x1F] if (sampRateByte & 0x1F) < len(self.const_VBAN_SRList) else 0
+		self.stream_sampNum = sampNum + 1
+		self.stream_chanNum = chanNum + 1
+
+	# params: bytes data, tuple addr, float arrival
+	# arrival is the time at which the packet came in, in seconds
+	def handlePacket(self, data, addr, arrival):
+		if not self.running or len(data) < 28:
+			return
+		self.rawData = data
+		self._parseHeader(data)
+		if self.verbose:
+			logging.debug("R"+self._cutAtNullByte(self.stream_magicString)+" "+str(self.stream_sampRate)+"Hz "+str(self.stream_sampNum)+"samp "+str(self.stream_chanNum)+"chan Format:"+str(self.stream_dataFormat)+" Name:"+self._cutAtNullByte(self.stream_streamName)+" Frame:"+str(self.stream_frameCounter))
+		self.rawPcm = data[28:]   #Header stops at 28
+		if self.stream_magicString == b"VBAN" and self.stream_sampRate != 0 and (self.subprotocol == 0 or self.subprotocol == VBAN_SubProtocolRedundancy >> 5):
+			route = self.routes.get((addr[0], self.stream_streamName))
+			if route is None:
+				route = self.routes.get((None, self.stream_streamName))
+				if route is None:
+					return
+			if self.subprotocol == 0:
+				route.handlePayload(self, self.rawPcm, arrival)
+			else:
+				route.handleRedundancy(self, self.rawPcm)
 
 	def runonce(self):
-		if self.stream == None:
+		if not self.running:
 			logging.info("Quit has been called")
 			return
 
 		try:
-			data, addr = self.sock.recvfrom(2048) # buffer size is normally 1436 bytes Max size for vban
-			self.rawData = data
-			self._parseHeader(data)
-			if self.verbose:
-				logging.debug("R"+self.stream_magicString+" "+str(self.stream_sampRate)+"Hz "+str(self.stream_sampNum)+"samp "+str(self.stream_chanNum)+"chan Format:"+str(self.stream_dataFormat)+" Name:"+self.stream_streamName+" Frame:"+str(self.stream_frameCounter))
-			self.rawPcm = data[28:]   #Header stops at 28
-			if self.stream_magicString == "VBAN" and self.subprotocol == 0:
-				if self.stream_streamName != self.streamName:
-					return
-				if (not self.any_sender) and (addr[0] != self.senderIp):
-					return
-				if self.channels != self.stream_chanNum or self.sampRate != self.stream_sampRate:
-					self._correctPyAudioStream()
-				self.stream.write(self.rawPcm)
+			# memoryview slot
+			slot = self.pool.next()
+			# buffer size is normally 1436 bytes Max size for vban
+			nbytes, addr = self.sock.recvfrom_into(slot)
+			self.handlePacket(slot[0:nbytes], addr, time.monotonic())
 
 		except OSError as e:
 			if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
@@ -115,42 +757,273 @@ class VBAN_Recv(object):
 			else:
 				raise e
 
+	# params: int maxPackets
+	# return: int
+	# receives up to maxPackets waiting packets into the pool in one go, then handles them all
+	# returns how many packets were received, stopping early once the socket has nothing left
+	def runbatch(self, maxPackets):
+		batch = self.pool.batch
+		count = 0
+		while count < maxPackets and count < len(batch):
+			slot = self.pool.slots[count]
+			try:
+				nbytes, addr = self.sock.recvfrom_into(slot)
+			except (BlockingIOError, InterruptedError):
+				break
+			batch[count] = (nbytes, addr, time.monotonic())
+			count += 1
+		for i in range(count):
+			nbytes, addr, arrival = batch[i]
+			try:
+				self.handlePacket(self.pool.slots[i][0:nbytes], addr, arrival)
+			except Exception:
+				# one bad packet shouldn't cost us the rest of the batch
+				logging.exception("Error handling VBAN packet from {}".format(addr[0]))
+		return count
+
+	def _onReadable(self):
+		# the selector tells us at least one packet is waiting; take everything that's there, so a burst (a sender
+		# catching up, or the loop coming back from something slow) costs one wakeup rather than one per packet
+		self.runbatch(len(self.pool.batch))
+
+	# event-driven alternative to runforever(); packets are handled as soon as they arrive, with no polling
+	async def listen(self):
+		loop = asyncio.get_running_loop()
+		try:
+			# read straight into the pool when the loop lets us watch the socket ourselves
+			loop.add_reader(self.sock.fileno(), self._onReadable)
+			self.readerLoop = loop
+		except NotImplementedError:
+			# Windows' proactor loop can't watch sockets for readiness; let asyncio do the reading
+			self.transport, protocol = await loop.create_datagram_endpoint(lambda: VBAN_RecvProtocol(self), sock=self.sock)
+
 	def runforever(self):
 		while self.running:
-			self.runonce()
+			if self.runbatch(len(self.pool.batch)) == 0:
+				if self.verbose:
+					logging.debug("No incoming data.")
+				# signal that we've run out of data to receive, as runonce() does
+				raise IndexError()
 		self.quit()
 
-	def quit(self):
+	# params: memoryview slot
+	# return: (int, tuple, float)
+	# byte count, sender address and arrival time in seconds
+	def _receiveStamped(self, slot):
+		if not self.kernelTimestamps:
+			nbytes, addr = self.sock.recvfrom_into(slot)
+			return nbytes, addr, time.monotonic()
+		nbytes, ancdata, flags, addr = self.sock.recvmsg_into([slot], 64)
+		for level, kind, data in ancdata:
+			if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= VBAN_Timespec.size:
+				sec, nsec = VBAN_Timespec.unpack_from(data)
+				return nbytes, addr, sec + nsec * 1e-9
+		# kernel timestamps are wall-clock time, so stay on the same clock if one goes missing
+		return nbytes, addr, time.time()
+
+	def _threadMain(self):
+		logging.info("VBAN receiver thread running")
+		while self.running:
+			slot = self.pool.next()
+			try:
+				nbytes, addr, arrival = self._receiveStamped(slot)
+			except socket.timeout:
+				# nothing arrived; go round again so we notice quit()
+				continue
+			except OSError:
+				if self.running:
+					logging.exception("VBAN receive failed")
+				continue
+			try:
+				self.handlePacket(slot[0:nbytes], addr, arrival)
+			except Exception:
+				logging.exception("Error handling VBAN packet from {}".format(addr[0]))
+		logging.info("VBAN receiver thread stopped")
+
+	# receives on a dedicated thread instead of the event loop, so slow commands and file writes on the loop can't
+	# hold packets up
+	# with kernel timestamps (Linux only), jitter is measured from when packets reached the host
+	def startThread(self):
+		if sys.platform.startswith("linux") and hasattr(self.sock, "recvmsg_into"):
+			try:
+				self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+				self.kernelTimestamps = True
+			except OSError:
+				logging.warning("Kernel receive timestamps unavailable; timing packets in user space")
+		# block, but wake up regularly to check whether we've been told to quit
+		self.sock.settimeout(0.25)
+		self.thread = threading.Thread(target=self._threadMain, name="VBAN_Recv", daemon=True)
+		self.thread.start()
+
+	# blocks until the receiver thread has finished, which can take as long as the socket timeout; run it off the
+	# event loop (see sound.run_vban_receiver) before calling quit() from there
+	def stopThread(self):
 		self.running = False
-		self.stream.close()
-		self.stream = None
+		if self.thread is not None and self.thread is not threading.current_thread():
+			# let the thread finish whatever packet it's on before the stream goes away
+			self.thread.join()
+			self.thread = None
 
-class VBAN_Send(object):
-	"""docstring for VBAN_Send"""
-	def __init__(self, toHost, toPort, streamName, sampRate, inDeviceIndex, ipv6=True, verbose=False ):
-		super(VBAN_Send, self).__init__()
-		self.streamName = streamName
+	def quit(self):
+		self.stopThread()
+		if self.transport is not None:
+			self.transport.close()
+			self.transport = None
+		if self.readerLoop is not None:
+			self.readerLoop.remove_reader(self.sock.fileno())
+			self.readerLoop = None
+		for route in list(self.routes.values()):
+			for stream in route.streams:
+				stream.close()
+			self.removeRoute(route)
+		self.sock.close()
+
+class VBAN_SendQueue(object):
+	"""Fixed slots of captured PCM waiting to be sent, one packet's worth each
+
+	Filled from PortAudio's callback thread and emptied by the sender thread.  Like sound.FrameRing, each side only
+	advances its own counter, and only after copying, so no lock is needed with one of each.
+	"""
+	# params: int size, int slotSize
+	def __init__(self, size, slotSize):
+		super(VBAN_SendQueue, self).__init__()
+		self.slotSize = slotSize
+		self.buffer = bytearray(size * slotSize)
+		view = memoryview(self.buffer)
+		# List[memoryview] slots
+		self.slots = [view[i * slotSize:(i + 1) * slotSize] for i in range(size)]
+		# int writeCount, readCount
+		# slots ever filled and emptied
+		self.writeCount = 0
+		self.readCount = 0
+
+	def __len__(self):
+		return self.writeCount - self.readCount
+
+	# params: bytes-like data
+	# return: boolean
+	# False if the queue is full and data was dropped
+	def put(self, data):
+		if len(self) >= len(self.slots):
+			return False
+		self.slots[self.writeCount % len(self.slots)][0:len(data)] = data
+		self.writeCount += 1
+		return True
+
+	# return: memoryview
+	# the oldest slot; stays valid until pop()
+	def peek(self):
+		return self.slots[self.readCount % len(self.slots)]
+
+	def pop(self):
+		self.readCount += 1
+
+	# params: writable buffer
+	# return: boolean
+	# copies the oldest slot into buffer and frees it; False if there was nothing queued
+	def readinto(self, buffer):
+		if len(self) == 0:
+			return False
+		buffer[0:self.slotSize] = self.slots[self.readCount % len(self.slots)]
+		self.readCount += 1
+		return True
+
+# params: str destination, int defaultPort
+# return: tuple
+# splits "host", "host:port", "[v6 address]:port" or a bare IPv6 address into (host, port)
+def parseDestination(destination, defaultPort):
+	destination = destination.strip()
+	if destination.startswith("["):
+		host, _, port = destination[1:].partition("]")
+		port = port.lstrip(":")
+	elif destination.count(":") == 1:
+		host, _, port = destination.partition(":")
+	else:
+		host, port = destination, ""
+	return (host, int(port) if port else defaultPort)
+
+class VBAN_SendDestination(object):
+	"""One host VBAN_Send sends to, with a UDP socket connected to it
+
+	Each destination gets its own connected socket, so that when a host goes away the ICMP errors it causes come back
+	on that destination's socket and are counted against it, not against every destination.
+	"""
+	# params: str host, int port, boolean ipv6
+	def __init__(self, host, port, ipv6=True):
+		super(VBAN_SendDestination, self).__init__()
+		self.host = host
+		self.port = port
+		self.sock = None
 		family = socket.AF_INET6 if ipv6 else socket.AF_INET
-		self.toPort = toPort
 		# Find our target address
-		for addrInfoTuple in socket.getaddrinfo(toHost, toPort, type=socket.SOCK_DGRAM, family=family, proto=socket.IPPROTO_UDP):
+		for addrInfoTuple in socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM, family=family, proto=socket.IPPROTO_UDP):
 			# Break up the tuple
 			famInfo, typeInfo, protoInfo, canonName, socketAddr = addrInfoTuple
 			self.socketAddr = socketAddr
-			self.toIp = socketAddr[0]	# The first element of the sockAddr tuple is the IP address under both IPv4 and IPv6
+			self.ip = socketAddr[0]	# The first element of the sockAddr tuple is the IP address under both IPv4 and IPv6
 			try:
 				self.sock = socket.socket(family, socket.SOCK_DGRAM) # UDP
 				self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 				self.sock.connect(socketAddr)
-			except Exception:
-				logging.exception()
+			except OSError:
+				logging.exception("Could not connect a VBAN socket to {}".format(socketAddr))
 				self.sock = None
 				continue
 			break
 		if self.sock is None:
-			raise RuntimeError("Could not initialize VBAN recv socket!")
-
+			raise RuntimeError("Could not initialize VBAN send socket for {}!".format(host))
 		self.sock.setblocking(False)
+		# int sendErrors
+		self.sendErrors = 0
+
+	# return: str
+	def __str__(self):
+		return "{}:{}".format("[" + self.ip + "]" if ":" in self.ip else self.ip, self.port)
+
+	def close(self):
+		self.sock.close()
+
+class VBAN_Send(object):
+	"""Captures from an input device and sends it as a VBAN stream
+
+	PortAudio hands each captured chunk to a callback, which queues it.  A sender thread sends one packet per chunk
+	period on a fixed schedule, so packets go out evenly spaced however the audio driver bunches up its callbacks, and
+	nothing spins while there's nothing to send.
+
+	Audio is captured and packetized once however many destinations there are; each packet then goes to all of them.
+	"""
+	# float queueSeconds
+	# how much captured audio the queue holds, whatever the packet size
+	queueSeconds = 0.04
+	# int queueSurplus
+	# if at least this many chunks were still waiting even at the emptiest point in the last second, we're holding
+	# more than we need; send an extra packet to trim it
+	queueSurplus = 2
+	# params: List[str] toHost, int toPort, str streamName, int sampRate, int inDeviceIndex, boolean ipv6, boolean verbose,
+	#         int chunkSize, int mtu
+	# toHost is a host or a list of them, each of which may carry its own port as "host:port"; toPort is for those
+	# that don't
+	# chunkSize is samples per packet; None for the most that fit in one packet on a link with this MTU
+	# redundancy is None, "duplicate" to send each packet's audio again redundancyGroup packets later, or "parity" to
+	# follow every redundancyGroup packets with the XOR of them
+	def __init__(self, toHost, toPort, streamName, sampRate, inDeviceIndex, ipv6=True, verbose=False, chunkSize=None, mtu=1500, redundancy=None, redundancyGroup=4):
+		super(VBAN_Send, self).__init__()
+		self.streamName = streamName
+		if isinstance(toHost, str):
+			toHost = [toHost]
+		# List[VBAN_SendDestination] destinations
+		# every packet goes to all of these; one that can't be resolved or connected is left out rather than stopping
+		# the others
+		self.destinations = []
+		for destination in toHost:
+			host, port = parseDestination(destination, toPort)
+			try:
+				self.destinations.append(VBAN_SendDestination(host, port, ipv6))
+			except (OSError, RuntimeError):
+				logging.exception("Can't send VBAN to {}".format(destination))
+		if len(self.destinations) == 0:
+			raise RuntimeError("Could not initialize any VBAN send socket!")
+
 		self.const_VBAN_SR = [6000, 12000, 24000, 48000, 96000, 192000, 384000, 8000, 16000, 32000, 64000, 128000, 256000, 512000,11025, 22050, 44100, 88200, 176400, 352800, 705600]
 		self.channels = sd.default.channels[0]
 		if sampRate not in self.const_VBAN_SR:
@@ -158,45 +1031,247 @@ class VBAN_Send(object):
 			return
 		self.samprate = sampRate
 		self.inDeviceIndex = inDeviceIndex
-		self.chunkSize = 256
-		self.stream = sd.RawInputStream(device=self.inDeviceIndex)
-		self.stream.start()
+		if redundancy not in (None, "duplicate", "parity"):
+			logging.warning("Unknown VBAN redundancy mode \"{}\"; sending without".format(redundancy))
+			redundancy = None
+		self.redundancy = redundancy
+		self.redundancyGroup = max(1, min(redundancyGroup, VBAN_JitterBuffer.redundancy_span - 1))
+		# int largest
+		# we only send 16-bit audio, and redundancy packets carry a little more than the audio packets
+		largest = largestChunkSize(self.channels, 2, mtu, ipv6, VBAN_RedundancyHeader.size if redundancy is not None else 0)
+		if chunkSize is None:
+			chunkSize = largest
+		elif chunkSize > largest:
+			logging.warning("{} samples per packet won't fit in a VBAN packet with an MTU of {}; sending {}".format(chunkSize, mtu, largest))
+			chunkSize = largest
+		self.chunkSize = max(1, chunkSize)
+		# float period
+		# seconds of audio in each packet
+		self.period = self.chunkSize / self.samprate
+		self.queue = VBAN_SendQueue(max(4, int(np.ceil(VBAN_Send.queueSeconds / self.period))), self.chunkSize * self.channels * 2)
 
 		self.framecounter = 0
 		self.running = True
 		self.verbose = verbose
-		self.rawPcm = None
-		self.rawData = None
+		# bytearray packet
+		# every packet is assembled in here: the header up to the frame counter never changes, so it's written once,
+		# and each send only fills in the counter and copies the PCM in behind it
+		self.packet = bytearray(VBAN_Header.size + self.queue.slotSize)
+		VBAN_Header.pack_into(self.packet, 0, b"VBAN", self.const_VBAN_SR.index(self.samprate), self.chunkSize-1, self.channels-1, 0x01, packStreamName(self.streamName), 0) # 0x01: VBAN_CODEC_PCM, 16-bit
+		# memoryview payload
+		self.payload = memoryview(self.packet)[VBAN_Header.size:]
+		if self.redundancy is not None:
+			self._setupRedundancy()
+		# int bytesSent, redundancyBytesSent
+		# counted once, however many destinations there are
+		self.bytesSent = 0
+		self.redundancyBytesSent = 0
+		self.thread = None
+		# int overruns
+		# chunks captured while the queue was full, and chunks PortAudio itself lost
+		self.overruns = 0
+		# int underruns
+		# send slots that came round with nothing captured to fill them
+		self.underruns = 0
+		# int sendErrors
+		self.sendErrors = 0
+		self._resetStats()
+
+		# one chunk per callback, so each one is exactly a packet's worth
+		self.stream = sd.RawInputStream(device=self.inDeviceIndex, blocksize=self.chunkSize, callback=self._capture)
+		self.stream.start()
+
+	def _setupRedundancy(self):
+		# bytearray redundancyPacket
+		# built the same way as packet; the header differs only in the sub-protocol and in carrying the counter of the
+		# first packet covered, followed by what kind of redundancy it is
+		self.redundancyPacket = bytearray(VBAN_Header.size + VBAN_RedundancyHeader.size + self.queue.slotSize)
+		VBAN_Header.pack_into(self.redundancyPacket, 0, b"VBAN", VBAN_SubProtocolRedundancy | self.const_VBAN_SR.index(self.samprate), self.chunkSize-1, self.channels-1, 0x01, packStreamName(self.streamName), 0)
+		if self.redundancy == "duplicate":
+			VBAN_RedundancyHeader.pack_into(self.redundancyPacket, VBAN_Header.size, VBAN_RedundancyDuplicate, 1, self.redundancyGroup)
+			# bytearray history
+			# the last redundancyGroup payloads, each waiting to go out again
+			self.history = bytearray(self.redundancyGroup * self.queue.slotSize)
+			view = memoryview(self.history)
+			# List[memoryview] historySlots
+			self.historySlots = [view[i * self.queue.slotSize:(i + 1) * self.queue.slotSize] for i in range(self.redundancyGroup)]
+		else:
+			VBAN_RedundancyHeader.pack_into(self.redundancyPacket, VBAN_Header.size, VBAN_RedundancyParity, self.redundancyGroup, self.redundancyGroup - 1)
+		# memoryview redundancyPayload
+		self.redundancyPayload = memoryview(self.redundancyPacket)[VBAN_Header.size + VBAN_RedundancyHeader.size:]
+		# np.ndarray parity, payloadBytes
+		# the same memory as redundancyPayload and payload, for XORing in place
+		self.parity = np.frombuffer(self.redundancyPacket, dtype=np.uint8, offset=VBAN_Header.size + VBAN_RedundancyHeader.size)
+		self.payloadBytes = np.frombuffer(self.packet, dtype=np.uint8, offset=VBAN_Header.size)
+
+	# return: boolean
+	# after sending packet framecounter: fills in redundancyPacket and returns whether it's due to go out now
+	def _constructRedundancy(self):
+		if self.redundancy == "duplicate":
+			# memoryview slot
+			# holds the payload from redundancyGroup packets ago, which is what goes out again now
+			slot = self.historySlots[self.framecounter % self.redundancyGroup]
+			due = self.framecounter > self.redundancyGroup
+			if due:
+				self.redundancyPayload[:] = slot
+				VBAN_FrameCounter.pack_into(self.redundancyPacket, VBAN_FrameCounterOffset, (self.framecounter - self.redundancyGroup) & 0xFFFFFFFF)
+			slot[:] = self.payload
+			return due
+		# int position
+		# where this packet falls in its parity group
+		position = (self.framecounter - 1) % self.redundancyGroup
+		if position == 0:
+			self.redundancyPayload[:] = self.payload
+		else:
+			np.bitwise_xor(self.parity, self.payloadBytes, out=self.parity)
+		if position < self.redundancyGroup - 1:
+			return False
+		VBAN_FrameCounter.pack_into(self.redundancyPacket, VBAN_FrameCounterOffset, (self.framecounter - position) & 0xFFFFFFFF)
+		return True
+
+	# params: bytearray packet
+	# return: boolean
+	# whether it reached at least one destination
+	def _sendToAll(self, packet):
+		# bool sent
+		sent = False
+		# the packet is built once and the same buffer goes out on every socket; each one is connected, so there's
+		# no address to resolve per packet either
+		for destination in self.destinations:
+			try:
+				destination.sock.send(packet)
+				sent = True
+			except OSError:
+				# a full socket buffer or an unreachable host; the stream carries on either way, and so do the others
+				destination.sendErrors += 1
+				self.sendErrors += 1
+				if self.verbose:
+					logging.exception("VBAN send to {} failed".format(destination))
+		return sent
 
-	def _constructFrame(self,pcmData):
-		header  = b"VBAN" 
-		header += bytes([self.const_VBAN_SR.index(self.samprate)])
-		header += bytes([self.chunkSize-1])
-		header += bytes([self.channels-1])
-		header += b'\x01'  #VBAN_CODEC_PCM
-		header += bytes(self.streamName + "\x00" * (16 - len(self.streamName)), 'utf-8')
-		header += struct.pack("<L",self.framecounter)
+	def _resetStats(self):
+		# float lastSend
+		self.lastSend = None
+		# int intervals
+		self.intervals = 0
+		# float intervalSum, intervalSquares, worstDeviation
+		# in seconds; deviation is measured from the ideal packet period
+		self.intervalSum = 0.0
+		self.intervalSquares = 0.0
+		self.worstDeviation = 0.0
+
+	# params: buffer indata, int frames, CData time, sd.CallbackFlags status
+	# runs on PortAudio's thread; no logging or anything else that might block in here
+	def _capture(self, indata, frames, time, status):
+		if status.input_overflow:
+			self.overruns += 1
+		if not self.queue.put(indata):
+			self.overruns += 1
+
+	# return: boolean
+	# moves the oldest queued chunk into the packet and stamps the next frame counter on it; False if there's nothing
+	# queued
+	def _constructFrame(self):
+		if not self.queue.readinto(self.payload):
+			return False
+		self.framecounter = (self.framecounter + 1) & 0xFFFFFFFF
+		VBAN_FrameCounter.pack_into(self.packet, VBAN_FrameCounterOffset, self.framecounter)
 		if self.verbose:
 			logging.debug("SVBAN "+str(self.samprate)+"Hz "+str(self.chunkSize)+"samp "+str(self.channels)+"chan Format:1 Name:"+self.streamName+" Frame:"+str(self.framecounter))
-		return header+pcmData
+		return True
 
-	def runonce(self):
-		self.framecounter += 1
-		try:
-			self.rawPcm = bytes(self.stream.read(self.chunkSize)[0])
-			self.rawData = self._constructFrame(self.rawPcm)
-			self.sock.sendto(self.rawData, self.socketAddr)
-		except Exception as e:
-			logging.exception()
+	# params: boolean record
+	# return: boolean
+	# sends the oldest queued chunk to every destination, if there is one; pass record=False for a send outside the
+	# schedule, so it doesn't count towards the packet spacing
+	def runonce(self, record=True):
+		if not self._constructFrame():
+			return False
+		if self._sendToAll(self.packet) and record:
+			self._recordSend(time.perf_counter())
+		self.bytesSent += len(self.packet)
+		if self.redundancy is not None and self._constructRedundancy():
+			# straight after the audio, so it's paced along with it
+			self._sendToAll(self.redundancyPacket)
+			self.redundancyBytesSent += len(self.redundancyPacket)
+		return True
+
+	# params: float now
+	def _recordSend(self, now):
+		if self.lastSend is not None:
+			interval = now - self.lastSend
+			self.intervals += 1
+			self.intervalSum += interval
+			self.intervalSquares += interval * interval
+			self.worstDeviation = max(self.worstDeviation, abs(interval - self.period))
+		self.lastSend = now
+
+	# return: str
+	# packet spacing since the last call, then starts counting afresh
+	def sendStats(self):
+		if self.intervals == 0:
+			return "No VBAN packets sent"
+		mean = self.intervalSum / self.intervals
+		deviation = np.sqrt(max(0.0, self.intervalSquares / self.intervals - mean * mean))
+		stats = "VBAN send spacing over {} packets: mean {:.3f} ms (ideal {:.3f} ms), jitter {:.3f} ms, worst {:.3f} ms off; {} overruns, {} underruns, {} send errors".format(
+			self.intervals, mean * 1000.0, self.period * 1000.0, deviation * 1000.0, self.worstDeviation * 1000.0, self.overruns, self.underruns, self.sendErrors)
+		if len(self.destinations) > 1:
+			stats += " ({})".format(", ".join("{} to {}".format(destination.sendErrors, destination) for destination in self.destinations))
+		if self.redundancy is not None:
+			stats += "; {} redundancy adds {:.0f}% to the data sent".format(self.redundancy, 100.0 * self.redundancyBytesSent / max(1, self.bytesSent))
+		lastSend = self.lastSend
+		self._resetStats()
+		self.lastSend = lastSend
+		return stats
 
 	def runforever(self):
+		# start the schedule from the first chunk, so it's in step with the device
+		while self.running and len(self.queue) == 0:
+			time.sleep(self.period / 4)
+		# float nextSend
+		nextSend = time.perf_counter()
+		# int ticks
+		ticks = 0
+		# int ticksPerSecond
+		ticksPerSecond = max(1, int(round(1.0 / self.period)))
+		# int lowest
+		# fewest chunks waiting at any send over the last second
+		lowest = len(self.queue)
 		while self.running:
-			self.runonce()
+			delay = nextSend - time.perf_counter()
+			if delay > 0:
+				time.sleep(delay)
+			lowest = min(lowest, len(self.queue))
+			if not self.runonce():
+				# the chunk for this slot hasn't arrived yet; it goes out next time, leaving one more chunk of slack
+				# from then on, which is how we learn how bunched up the driver's callbacks are
+				self.underruns += 1
+			ticks += 1
+			if ticks % ticksPerSecond == 0:
+				if lowest >= VBAN_Send.queueSurplus:
+					# either the device clock runs a little fast against ours or we've more slack than we need
+					self.runonce(record=False)
+				lowest = len(self.queue)
+			nextSend += self.period
+			now = time.perf_counter()
+			if nextSend < now - self.period:
+				# we've fallen well behind (the machine was busy or asleep); start the schedule again from here
+				nextSend = now
+
+	def startThread(self):
+		self.thread = threading.Thread(target=self.runforever, name="VBAN_Send", daemon=True)
+		self.thread.start()
 
 	def quit(self):
 		self.running = False
+		if self.thread is not None and self.thread is not threading.current_thread():
+			self.thread.join()
+			self.thread = None
+		self.stream.stop()
 		self.stream.close()
 		self.stream = None
+		for destination in self.destinations:
+			destination.close()
 
 class VBAN_SendText(object):
 	"""docstring for VBAN_SendText"""
@@ -212,13 +1287,8 @@ class VBAN_SendText(object):
 		self.framecounter = 0
 
 	def _constructFrame(self,text):
-		header  = b"VBAN" 
-		header += bytes([int("0b01000000",2)  + self.VBAN_BPSList.index(self.baudRate)])
-		header += b'\x00'
-		header += b'\x00' #Channel indent 0 by default
-		header += bytes([int("0b00010000",2)]) # UTF8
-		header += bytes(self.streamName + "\x00" * (16 - len(self.streamName)), 'utf-8')
-		header += struct.pack("<L",self.framecounter)
+		# sub-protocol 0b010 (text), channel ident 0 by default, 0b00010000: UTF8
+		header = VBAN_Header.pack(b"VBAN", int("0b01000000",2) + self.VBAN_BPSList.index(self.baudRate), 0, 0, int("0b00010000",2), packStreamName(self.streamName), self.framecounter)
 		return header+bytes(text, 'utf-8')
 
 	def send(self,text):
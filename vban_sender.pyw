@@ -25,8 +25,9 @@ sd.default.latency = "low"
 sd.default.samplerate = 48000
 
 async def main():
-	# str host
-	host = config.get_config_string("VBAN", "outgoing_host")
+	# List[str] hosts
+	# every host gets the same stream; any of them can name its own port as host:port
+	hosts = config.get_config_list("VBAN", "outgoing_host")
 	# int port
 	port = config.get_config_int("VBAN", "outgoing_port")
 	# str stream_name
@@ -37,6 +38,24 @@ async def main():
 	ipv6 = config.get_config_bool("VBAN", "ipv6")
 	# bool verbose
 	verbose = config.get_config_bool("VBAN", "verbose")
+	# int mtu
+	mtu = config.get_config_int("VBAN", "mtu")
+	# str packet_samples
+	packet_samples = config.get_config_string("VBAN", "packet_samples")
+	# int chunk_size
+	# None lets the sender fit as many samples as the MTU allows
+	chunk_size = None
+	if packet_samples == "latency":
+		chunk_size = vban.latencyChunkSize(sd.default.samplerate)
+	elif packet_samples != "auto":
+		chunk_size = int(packet_samples)
+	# str redundancy
+	# off, duplicate or parity
+	redundancy = config.get_config_string("VBAN", "redundancy")
+	if redundancy == "off":
+		redundancy = None
+	# int redundancy_group
+	redundancy_group = config.get_config_int("VBAN", "redundancy_group")
 	
 	if verbose:
 		print_handler.setLevel(logging.DEBUG)
@@ -47,21 +66,20 @@ async def main():
 
 	try:
 		# vban.VBAN_Send sender
-		sender = vban.VBAN_Send(host, port, stream_name, sd.default.samplerate, device_id, ipv6=ipv6, verbose=verbose)
-		# str printed_ip
-		printed_ip = sender.toIp
-		if ipv6:
-			printed_ip = "[" + printed_ip + "]"
-		logging.info("Beginning VBAN stream \"{}\" to {}:{}".format(stream_name, printed_ip, port))
+		sender = vban.VBAN_Send(hosts, port, stream_name, sd.default.samplerate, device_id, ipv6=ipv6, verbose=verbose, chunkSize=chunk_size, mtu=mtu, redundancy=redundancy, redundancyGroup=redundancy_group)
+		logging.info("Beginning VBAN stream \"{}\" to {}".format(stream_name, ", ".join(str(destination) for destination in sender.destinations)))
+		logging.info("Sending {} samples ({:.2f} ms) per packet".format(sender.chunkSize, sender.period * 1000.0))
 		try:
+			# the sender paces itself on its own thread; we just report how evenly it's doing so
+			sender.startThread()
 			while True:
-				sender.runonce()
-				await asyncio.sleep(0)
+				await asyncio.sleep(config.get_config_float("VBAN", "stats_interval"))
+				logging.info(sender.sendStats())
 		finally:
 			sender.quit()
 	except Exception:
-		logging.exception()
-		logging.info("Connection to {} failed.".format(host))
+		logging.exception("VBAN sender stopped")
+		logging.info("Connection to {} failed.".format(", ".join(hosts)))
 
 # check dependency on pyaudio, as we don't import it, and not having it will silently fail
 if "pyaudio" not in {pkg.key for pkg in pkg_resources.working_set}: